@@ -0,0 +1,88 @@
+# benchmarks/alert_eval.py
+# Compares the per-alert loop check_alerts_once used to run with the
+# array-backed AlertTable.evaluate() on one origin with many alerts.
+#
+#   python -m benchmarks.alert_eval [N_ALERTS]
+import random
+import sys
+import time
+
+from bot import evaluator
+from bot.evaluator import AlertTable
+from bot.models import Alert
+
+
+def make_alerts(n, destinations):
+    rnd = random.Random(42)
+    alerts = []
+    for i in range(n):
+        target = rnd.choice([None, rnd.uniform(500_000, 3_000_000)])
+        last = rnd.choice([None, rnd.uniform(500_000, 4_000_000), rnd.uniform(500_000, 4_000_000)])
+        alerts.append(Alert(i, rnd.randrange(10_000), "TAS", rnd.choice(destinations), target, last))
+    return alerts
+
+
+def legacy_loop(alerts, prices):
+    """Decision logic of the old per-alert loop (without the send/DB side effects)."""
+    triggered, initialized = [], []
+    for row, alert in enumerate(alerts):
+        price = prices.get(alert.destination)
+        if price is None:
+            continue
+        if alert.last_price is None:
+            initialized.append(row)
+            continue
+        try:
+            current = float(price)
+            baseline = float(alert.last_price)
+        except Exception:
+            continue
+        should_notify = False
+        if alert.target_price is not None:
+            try:
+                tp = float(alert.target_price)
+            except Exception:
+                tp = None
+            if tp is not None and current <= tp and current < baseline:
+                should_notify = True
+        elif current < baseline:
+            should_notify = True
+        if should_notify:
+            triggered.append(row)
+    return triggered, initialized
+
+
+def best_of(fn, repeat=5):
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        out = fn()
+        times.append(time.perf_counter() - t)
+    return min(times), out
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    destinations = [f"D{i:02d}" for i in range(300)]
+    rnd = random.Random(7)
+    prices = {d: rnd.uniform(500_000, 4_000_000) for d in destinations if rnd.random() < 0.8}
+    alerts = make_alerts(n, destinations)
+
+    t = time.perf_counter()
+    table = AlertTable(alerts)
+    build = time.perf_counter() - t
+
+    loop_t, (loop_trig, loop_init) = best_of(lambda: legacy_loop(alerts, prices))
+    vec_t, res = best_of(lambda: table.evaluate(prices))
+    assert sorted(loop_trig) == sorted(int(r) for r in res.triggered)
+    assert sorted(loop_init) == sorted(int(r) for r in res.initialized)
+
+    print(f"alerts: {n}, destinations with a price: {len(prices)}, numpy: {evaluator.load_numpy() is not None}")
+    print(f"triggered: {len(loop_trig)}, baselines initialized: {len(loop_init)}")
+    print(f"legacy loop:        {loop_t * 1000:8.2f} ms")
+    print(f"AlertTable.evaluate:{vec_t * 1000:8.2f} ms  ({loop_t / vec_t:.1f}x)")
+    print(f"table build (once): {build * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
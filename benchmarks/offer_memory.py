@@ -0,0 +1,76 @@
+# benchmarks/offer_memory.py
+# Memory held per hot-offers response: the decoded GraphQL dicts the bot
+# used to keep versus the parsed HotOffers (Offer records, interned codes).
+#
+#   python -m benchmarks.offer_memory [RESPONSE.json] [COPIES]
+#   python -m benchmarks.offer_memory --record ORIGIN [RESPONSE.json]
+#
+# RESPONSE.json is a full response body ({"data": {"hot_offers_v1": ...}});
+# it defaults to benchmarks/fixtures/hot_offers_tas.json. --record saves a
+# live upstream response for ORIGIN to measure instead.
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+from bot.fetcher import API_URL, build_maps, build_payloads, extract_data
+from bot.models import HotOffers, parse_offers
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "hot_offers_tas.json")
+
+
+def record(origin, path):
+    import requests
+
+    for payload in build_payloads(origin):
+        r = requests.post(API_URL, json=payload, timeout=12)
+        body = r.json()
+        if extract_data(r.status_code, body):
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(body, f, ensure_ascii=False, indent=1)
+            print(f"saved {origin} response to {path}")
+            return
+    sys.exit(f"no usable response for {origin}")
+
+
+def held(make, copies):
+    """Bytes still allocated per copy after building `copies` results with make()."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [make() for _ in range(copies)]
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    return size / copies
+
+
+def parse(text):
+    data = extract_data(200, json.loads(text))
+    cities, airlines = build_maps(data)
+    return HotOffers(parse_offers(data.get("one_way_offers")), cities, airlines)
+
+
+def main():
+    if sys.argv[1:2] == ["--record"]:
+        record(sys.argv[2].upper(), sys.argv[3] if len(sys.argv) > 3 else FIXTURE)
+        return
+
+    path = sys.argv[1] if len(sys.argv) > 1 else FIXTURE
+    copies = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    n_offers = len(parse(text).offers)
+
+    raw = held(lambda: extract_data(200, json.loads(text)), copies)
+    parsed = held(lambda: parse(text), copies)
+
+    print(f"response: {path} ({len(text) / 1024:.1f} KiB JSON, {n_offers} offers), {copies} copies")
+    print(f"raw decoded dicts: {raw / 1024:8.1f} KiB per response")
+    print(f"parsed HotOffers:  {parsed / 1024:8.1f} KiB per response  ({raw / parsed:.1f}x smaller)")
+
+
+if __name__ == "__main__":
+    main()
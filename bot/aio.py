@@ -0,0 +1,297 @@
+# bot/aio.py
+# Opt-in asyncio runtime (BOT_RUNTIME=asyncio): one event loop runs Telegram
+# polling (AsyncTeleBot), the upstream fetches (aiohttp) and the scheduler,
+# so alert cycles fan out to many origins and users without a thread each.
+# The command handlers in handlers.py are reused unchanged through SyncBridge.
+import asyncio
+import inspect
+import os
+import signal
+import time
+import traceback
+from datetime import datetime
+from typing import Optional
+
+import aiohttp
+from telebot.async_telebot import AsyncTeleBot
+
+from .alerts import evaluate_origin
+from .bot import STARTED_AT, WARM_ORIGINS, trace_name
+from .db import init_db, load_alert_registry, top_origins, update_alert_prices, get_user_prefs
+from .fetcher import API_URL, build_payloads, extract_data, to_hot_offers
+from .handlers import register, sync_commands, DEFAULT_ORIGIN
+from .models import HotOffers
+from .profiling import span, trace
+from .rates import market_currency
+from .registry import alert_registry
+from .scheduler import MAINTENANCE_JOBS, deal_messages, due_subscriptions, job_history_flush, job_refresh_rates
+from .state import cities_cache, state_lock
+from .throttle import upstream_budget
+
+FETCH_CONCURRENCY = int(os.getenv("AIO_FETCH_CONCURRENCY", "32"))  # upstream requests in flight
+SEND_CONCURRENCY = int(os.getenv("AIO_SEND_CONCURRENCY", "25"))    # Telegram allows ~30 messages/s
+FETCH_TIMEOUT = aiohttp.ClientTimeout(total=12)
+
+
+class AsyncFetcher:
+    """aiohttp counterpart of fetcher.fetch_hot_offers; one session, bounded concurrency."""
+
+    def __init__(self, session: aiohttp.ClientSession, concurrency: int = FETCH_CONCURRENCY):
+        self.session = session
+        self.sem = asyncio.Semaphore(concurrency)
+
+    async def try_payloads(self, origin: str, currency: str = "uzs", market: str = "uz", **kwargs) -> Optional[dict]:
+        for payload in build_payloads(origin, currency, market, **kwargs):
+            try:
+                async with self.sem:
+                    with span("fetch.http"):
+                        async with self.session.post(API_URL, json=payload, timeout=FETCH_TIMEOUT) as r:
+                            body = await r.json(content_type=None)
+                            status = r.status
+            except Exception:
+                continue
+            data = extract_data(status, body)
+            if data:
+                return data
+        return None
+
+    async def fetch_hot_offers(self, origin: str, currency: str = "uzs", market: str = "uz", **kwargs) -> Optional[HotOffers]:
+        data = await self.try_payloads(origin, currency, market, **kwargs)
+        if not data:
+            return None
+        return to_hot_offers(origin, currency, market, data, kwargs.get("one_way", True), kwargs.get("depart_date"))
+
+
+class SyncBridge:
+    """
+    Presents an AsyncTeleBot to handlers.register() as if it were a TeleBot.
+
+    Each handler runs in the default thread pool (it does blocking SQLite and
+    requests work); its bot.* calls are scheduled back onto the event loop.
+    """
+
+    def __init__(self, abot: AsyncTeleBot, loop: asyncio.AbstractEventLoop):
+        self.abot = abot
+        self.loop = loop
+        self.first_response_done = False
+
+    def __getattr__(self, name):
+        attr = getattr(self.abot, name)
+        if not inspect.iscoroutinefunction(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            return asyncio.run_coroutine_threadsafe(attr(*args, **kwargs), self.loop).result()
+        return call
+
+    def _wrap(self, fn):
+        def run(update):
+            with trace(trace_name(update)):
+                fn(update)
+
+        async def handler(update):
+            try:
+                await asyncio.to_thread(run, update)
+            finally:
+                if not self.first_response_done:
+                    self.first_response_done = True
+                    print(f"[INFO] First response {time.perf_counter() - STARTED_AT:.2f}s after start.")
+        return handler
+
+    def message_handler(self, **kwargs):
+        def deco(fn):
+            self.abot.message_handler(**kwargs)(self._wrap(fn))
+            return fn
+        return deco
+
+    def callback_query_handler(self, **kwargs):
+        def deco(fn):
+            self.abot.callback_query_handler(**kwargs)(self._wrap(fn))
+            return fn
+        return deco
+
+
+async def _send(abot: AsyncTeleBot, sem: asyncio.Semaphore, user_id: int, text: str, parse_mode: Optional[str]) -> bool:
+    async with sem:
+        try:
+            with span("telegram.send_message"):
+                await abot.send_message(user_id, text, parse_mode=parse_mode, disable_web_page_preview=True)
+            return True
+        except Exception:
+            # if send fails, log and continue
+            print(f"[Aio] Failed to send message to {user_id}")
+            traceback.print_exc()
+            return False
+
+
+async def check_alerts_once(abot: AsyncTeleBot, fetcher: AsyncFetcher, send_sem: asyncio.Semaphore) -> int:
+    """Async check_alerts_once: fetch every origin concurrently, then send concurrently."""
+    def evaluate(origin: str, data: HotOffers):
+        # registry lock (held across SQLite by reconcile), table build, formatting and
+        # history lookups all block, so this runs in a worker thread, never on the loop
+        table = alert_registry.table(origin)
+        if not table:
+            return [], []
+        return evaluate_origin(origin, table, data)
+
+    async def process(origin: str) -> int:
+        upstream_budget.consume()
+        data = await fetcher.fetch_hot_offers(origin, "uzs", "uz", max_directions=50, locales=["ru"])
+        if not data:
+            return 0
+        notifications, baseline_updates = await asyncio.to_thread(evaluate, origin, data)
+        results = await asyncio.gather(*(_send(abot, send_sem, a.user_id, msg, "Markdown") for a, msg in notifications))
+        await asyncio.to_thread(update_alert_prices, baseline_updates)
+        return sum(results)
+
+    if not alert_registry.loaded:
+        # the startup load failed; retry now instead of waiting for the reconcile job
+        await asyncio.to_thread(load_alert_registry)
+    origins = await asyncio.to_thread(alert_registry.origins)
+    counts = await asyncio.gather(*(process(o) for o in origins), return_exceptions=True)
+    sent = 0
+    for c in counts:
+        if isinstance(c, Exception):
+            print("[Aio] Failed to process an origin:", repr(c))
+        else:
+            sent += c
+    await asyncio.to_thread(job_history_flush)
+    return sent
+
+
+async def send_deals(abot: AsyncTeleBot, fetcher: AsyncFetcher, send_sem: asyncio.Semaphore, user_id: int, origin: str):
+    currency, market = await asyncio.to_thread(get_user_prefs, user_id)
+    upstream_budget.consume()
+    data = await fetcher.fetch_hot_offers(origin, market_currency(market), market, max_directions=50, locales=["ru"])
+    texts, parse_mode = deal_messages(origin, data, currency)
+    for text in texts:
+        await _send(abot, send_sem, user_id, text, parse_mode)
+
+
+async def _every(seconds: float, job):
+    """Run `job` (a coroutine function) forever, `seconds` after the previous run finished."""
+    while True:
+        await asyncio.sleep(seconds)
+        try:
+            await job()
+        except Exception:
+            traceback.print_exc()
+
+
+def _log_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        traceback.print_exception(task.exception())
+
+
+async def _each_minute(job, running: set):
+    """
+    Start job(minute) as its own task at every minute boundary, with that minute.
+
+    A run that overruns does not delay or skip the next minute, and an early
+    wake-up never hands the job the previous minute again.
+    """
+    boundary = (time.time() // 60 + 1) * 60
+    while True:
+        while (delay := boundary - time.time()) > 0:
+            await asyncio.sleep(delay)
+        task = asyncio.create_task(job(datetime.fromtimestamp(boundary)))
+        running.add(task)
+        task.add_done_callback(running.discard)
+        task.add_done_callback(_log_failure)
+        boundary += 60
+
+
+async def run_scheduler(abot: AsyncTeleBot, fetcher: AsyncFetcher):
+    """Async replacement for scheduler.run_scheduler; returns once all job tasks are started."""
+    send_sem = asyncio.Semaphore(SEND_CONCURRENCY)
+
+    async def job_subscriptions(minute: datetime):
+        with trace("subscriptions_job"):
+            due = await asyncio.to_thread(due_subscriptions, minute)
+            results = await asyncio.gather(*(send_deals(abot, fetcher, send_sem, u, o) for u, o in due),
+                                           return_exceptions=True)
+        for (user_id, origin), r in zip(due, results):
+            if isinstance(r, Exception):
+                print(f"[Aio] Failed to send deals to {user_id} for {origin}")
+                traceback.print_exception(r)
+
+    async def job_alerts():
+        with trace("alerts_cycle"):
+            sent = await check_alerts_once(abot, fetcher, send_sem)
+        if sent:
+            print(f"[Aio] Sent {sent} alert notifications.")
+
+    running = set()  # subscription runs in flight; the loop only keeps weak references
+    tasks = [
+        asyncio.create_task(_each_minute(job_subscriptions, running)),
+        asyncio.create_task(_every(60, job_alerts)),
+    ]
+    for minutes, job in MAINTENANCE_JOBS:
+        tasks.append(asyncio.create_task(_every(minutes * 60, lambda job=job: asyncio.to_thread(job))))
+    print("[Aio] scheduler started")
+    return tasks
+
+
+async def _startup(bridge: SyncBridge, fetcher: AsyncFetcher):
+    """Same background work as bot.background_startup, on the loop."""
+    try:
+        if await asyncio.to_thread(sync_commands, bridge):
+            print("[INFO] Bot commands updated.")
+    except Exception as e:
+        print("[WARN] Failed to set bot commands:", e)
+
+    try:
+        await asyncio.to_thread(load_alert_registry)
+    except Exception as e:
+        # the scheduler still starts; its periodic reconcile retries the load
+        print("[WARN] Failed to load alert registry:", e)
+
+    await asyncio.to_thread(job_refresh_rates)
+    try:
+        bridge.scheduler_tasks = await run_scheduler(bridge.abot, fetcher)
+    except Exception as e:
+        print("[WARN] Failed to start scheduler:", e)
+
+    t = time.perf_counter()
+    try:
+        origins = list(dict.fromkeys([DEFAULT_ORIGIN, *await asyncio.to_thread(top_origins, WARM_ORIGINS)]))
+        for _ in origins:
+            upstream_budget.consume()
+        results = await asyncio.gather(*(fetcher.fetch_hot_offers(o) for o in origins), return_exceptions=True)
+        default = results[0]
+        if isinstance(default, HotOffers) and default.cities:
+            with state_lock:
+                cities_cache.update({"data": default.cities, "ts": time.time()})
+        print(f"[INFO] Caches warmed in {time.perf_counter() - t:.2f}s.")
+    except Exception as e:
+        print("[WARN] Cache warm-up failed:", e)
+
+
+async def main_async():
+    init_db()
+    abot = AsyncTeleBot(os.getenv("TELEGRAM_TOKEN"), parse_mode="Markdown")
+    bridge = SyncBridge(abot, asyncio.get_running_loop())
+    register(bridge)
+
+    async with aiohttp.ClientSession() as session:
+        fetcher = AsyncFetcher(session)
+        startup = asyncio.create_task(_startup(bridge, fetcher))
+        polling = asyncio.create_task(abot.infinity_polling())
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, polling.cancel)
+
+        print(f"[INFO] Bot started (asyncio) in {time.perf_counter() - STARTED_AT:.2f}s. Listening...")
+        try:
+            await polling
+        except asyncio.CancelledError:
+            print("\n[INFO] Shutting down bot...")
+        finally:
+            startup.cancel()
+            for task in getattr(bridge, "scheduler_tasks", []):
+                task.cancel()
+            await abot.close_session()
+
+
+def main():
+    asyncio.run(main_async())
@@ -1,124 +1,153 @@
 # bot/alerts.py
-from typing import Dict, Any, List, Tuple
 import traceback
+from typing import List, Tuple
+
+from .db import update_alert_prices, get_user_prefs, load_alert_registry
+from .fetcher import fetch_hot_offers, cheapest_per_destination
+from . import history
+from .utils import compact_price
+from .rates import convert, convert_offer
+from .registry import alert_registry
+from .evaluator import AlertTable
+from .models import Alert, HotOffers
+from .throttle import upstream_budget
+from .profiling import span
+
+TREND_DAYS = 30
+
+def _route_stats(origin: str, destination: str):
+    """Stored 30-day (min, avg, max, n) for the route, or None; pending points are not flushed."""
+    try:
+        return history.window_stats(origin, destination, TREND_DAYS, flush_pending=False)
+    except Exception:
+        traceback.print_exc()
+        return None
+
+def _trend_line(stats, current: float, currency: str):
+    """One-line comparison of the current price with the route's 30-day stats, or None."""
+    if not stats:
+        return None
+    low, avg, _, _ = stats
+    if current <= low:
+        return f"📉 Самая низкая цена за {TREND_DAYS} дней"
+    src = history.HISTORY_CURRENCY
+    return (f"📉 Минимум за {TREND_DAYS} дней: {compact_price(convert(low, src, currency), currency)}, "
+            f"в среднем {compact_price(convert(avg, src, currency), currency)}")
+
+def evaluate_origin(origin: str, table: AlertTable, data: HotOffers) -> Tuple[List[Tuple[Alert, str]], List[Tuple[int, float]]]:
+    """
+    Evaluate one origin's alerts against freshly fetched offers.
+
+    Returns the notifications to send as (alert, message) pairs and the
+    (alert_id, price) baseline updates to write once they have been sent.
+    """
+    offers, cities_map, airlines_map = data
+    deals = {o.destination: o for o in cheapest_per_destination(offers)}
+
+    # all alerts of this origin are evaluated in one pass
+    with span("alerts.evaluate"):
+        result = table.evaluate({d: o.value for d, o in deals.items()})
+
+    # rows without a baseline get the current price and no notification
+    baseline_updates = [(table.alerts[r].id, float(result.current[r])) for r in result.initialized]
+    notifications = []
+    # history stats depend only on the route: one query per destination, not per alert
+    route_stats = {}
 
-from .db import list_alerts, update_alert_price
-from .fetcher import try_payloads, cheapest_per_destination, build_maps
+    for row in result.triggered:
+        alert = table.alerts[row]
+        try:
+            user_id, destination = alert.user_id, alert.destination
+            deal = deals[destination]
+            current = float(result.current[row])
+            currency, _ = get_user_prefs(user_id)
+
+            # build message
+            card_text = None
+            try:
+                # format_card_ru is not imported here to keep separation of concerns in alerts.
+                # We'll attach a concise message; scheduler previously used format_card_ru.
+                from .formatter import format_card_ru
+                card_text = format_card_ru(convert_offer(deal, currency), cities_map, airlines_map, origin)
+            except Exception:
+                card_text = f"{origin} → {destination}: {int(current)}"
+
+            msg = f"💰 Цена изменилась для рейса {origin} → {destination}:\n\n{card_text}"
+            if destination not in route_stats:
+                route_stats[destination] = _route_stats(origin, destination)
+            trend = _trend_line(route_stats[destination], current, currency)
+            if trend:
+                msg += f"\n{trend}"
+            notifications.append((alert, msg))
+            # update baseline price
+            baseline_updates.append((alert.id, current))
+
+        except Exception:
+            # Don't let one bad alert stop others
+            traceback.print_exc()
+            continue
 
-def _find_deal_for_destination(offers: List[Dict[str, Any]], destination: str):
-    """Return the offer dict for the given destination (or None)."""
-    for o in cheapest_per_destination(offers):
-        p = o.get("price") or {}
-        if p.get("destination_city_iata") == destination:
-            return o
-    return None
+    return notifications, baseline_updates
 
 def check_alerts_once(bot) -> int:
     """
     Check all active alerts and send notifications if conditions met.
 
+    Alerts come from the in-memory registry, so a cycle starts without
+    reading the alerts table; each origin's alerts are evaluated together
+    by its array-backed AlertTable (see evaluator.py).
+
     Returns:
         count of notifications sent.
     """
     sent = 0
-    alerts = list_alerts()
-    if not alerts:
+    if not alert_registry.loaded:
+        # the startup load failed; retry now instead of waiting for the reconcile job
+        load_alert_registry()
+    origins = alert_registry.origins()
+    if not origins:
         return 0
 
-    # Group alerts by origin to avoid fetching the same origin multiple times
-    origins: Dict[str, List[Dict[str, Any]]] = {}
-    for a in alerts:
-        origins.setdefault(a["origin"], []).append(a)
-
-    for origin, alerts_for_origin in origins.items():
+    for origin in origins:
         try:
-            data = try_payloads(origin, "uzs", "uz", max_directions=50, locales=["ru"])
+            table = alert_registry.table(origin)
+            if not table:
+                continue
+
+            # the alerts job has priority: it always spends from the shared budget
+            upstream_budget.consume()
+            data = fetch_hot_offers(origin, "uzs", "uz", max_directions=50, locales=["ru"])
             if not data:
                 # no data for this origin — skip all alerts for it
                 continue
 
-            offers = data.get("one_way_offers") or []
-            cities_map, airlines_map = build_maps(data)
-
-            for alert in alerts_for_origin:
+            notifications, baseline_updates = evaluate_origin(origin, table, data)
+            for alert, msg in notifications:
                 try:
-                    alert_id = int(alert["id"])
-                    user_id = alert["user_id"]
-                    destination = alert["destination"]
-                    target_price = alert["target_price"]
-                    last_price = alert["last_price"]
-                    active = alert["active"]
-
-                    if not active:
-                        continue
-
-                    deal = _find_deal_for_destination(offers, destination)
-                    if not deal:
-                        continue
-
-                    price_block = deal.get("price", {})
-                    price = price_block.get("value")
-                    if price is None:
-                        continue
-
-                    # If baseline not set, initialize it and skip notification
-                    if last_price is None:
-                        update_alert_price(alert_id, price)
-                        continue
-
-                    try:
-                        current = float(price)
-                        baseline = float(last_price)
-                    except Exception:
-                        continue
-
-                    should_notify = False
-                    if target_price is not None:
-                        try:
-                            tp = float(target_price)
-                        except Exception:
-                            tp = None
-                        if tp is not None and current <= tp and current < baseline:
-                            should_notify = True
-                    else:
-                        if current < baseline:
-                            should_notify = True
-
-                    if should_notify:
-                        # build message
-                        card_text = None
-                        try:
-                            # format_card_ru is not imported here to keep separation of concerns in alerts.
-                            # We'll attach a concise message; scheduler previously used format_card_ru.
-                            from .formatter import format_card_ru
-                            card_text = format_card_ru(deal, cities_map, airlines_map, origin)
-                        except Exception:
-                            card_text = f"{origin} → {destination}: {int(current)}"
-
-                        msg = f"💰 Цена изменилась для рейса {origin} → {destination}:\n\n{card_text}"
-                        try:
-                            bot.send_message(user_id, msg, parse_mode="Markdown", disable_web_page_preview=True)
-                            sent += 1
-                        except Exception:
-                            # if send fails, log and continue
-                            print(f"[Alerts] Failed to send message to {user_id} for alert {alert_id}")
-                            traceback.print_exc()
-
-                        # update baseline price
-                        try:
-                            update_alert_price(alert_id, current)
-                        except Exception:
-                            print(f"[Alerts] Failed to update baseline for alert {alert_id}")
-                            traceback.print_exc()
-
+                    with span("telegram.send_message"):
+                        bot.send_message(alert.user_id, msg, parse_mode="Markdown", disable_web_page_preview=True)
+                    sent += 1
                 except Exception:
-                    # Don't let one bad alert stop others
+                    # if send fails, log and continue
+                    print(f"[Alerts] Failed to send message to {alert.user_id} for alert {alert.id}")
                     traceback.print_exc()
-                    continue
+
+            try:
+                update_alert_prices(baseline_updates)
+            except Exception:
+                print(f"[Alerts] Failed to update baselines for origin {origin}")
+                traceback.print_exc()
 
         except Exception:
             print(f"[Alerts] Failed to fetch or process origin {origin}")
             traceback.print_exc()
             continue
 
+    # prices fetched during this cycle are written in one batch
+    try:
+        history.flush()
+    except Exception:
+        print("[Alerts] Failed to write price history")
+        traceback.print_exc()
+
     return sent
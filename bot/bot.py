@@ -1,14 +1,59 @@
 # bot/bot.py
+import time
+
+STARTED_AT = time.perf_counter()
+
 import signal
 import sys
 import os
+import threading
 from telebot import TeleBot
-from .handlers import register
-from .db import init_db
-from .scheduler import run_scheduler   
+from telebot.handler_backends import BaseMiddleware
+from .handlers import register, sync_commands, warm_caches
+from .db import init_db, load_alert_registry, top_origins
+from .profiling import start_trace, finish_trace
+
+BOT_TOKEN = os.getenv("TELEGRAM_TOKEN")
+bot = TeleBot(BOT_TOKEN, parse_mode="Markdown", use_class_middlewares=True)
+
+WARM_ORIGINS = 5  # most-used origins prefetched after startup
+
+
+class FirstResponseTimer(BaseMiddleware):
+    """Reports how long after process start the first update was answered."""
+
+    def __init__(self):
+        super().__init__()
+        self.update_types = ["message", "callback_query"]
+        self.done = False
+
+    def pre_process(self, message, data):
+        pass
+
+    def post_process(self, message, data, exception):
+        if not self.done:
+            self.done = True
+            print(f"[INFO] First response {time.perf_counter() - STARTED_AT:.2f}s after start.")
 
-BOT_TOKEN = os.getenv("TELEGRAM_TOKEN")  
-bot = TeleBot(BOT_TOKEN, parse_mode="Markdown")
+
+def trace_name(update) -> str:
+    """Trace name for a message or callback query: its command or callback prefix."""
+    text = getattr(update, "text", None) or getattr(update, "data", None) or ""
+    return "handler:" + (text.split()[0].split("_")[0] if text.strip() else "other")
+
+
+class TraceMiddleware(BaseMiddleware):
+    """Opens a profiling trace around every handler invocation."""
+
+    def __init__(self):
+        super().__init__()
+        self.update_types = ["message", "callback_query"]
+
+    def pre_process(self, message, data):
+        start_trace(trace_name(message))
+
+    def post_process(self, message, data, exception):
+        finish_trace()
 
 
 def shutdown(*args):
@@ -18,19 +63,50 @@ def shutdown(*args):
     sys.exit(0)
 
 
-def main():
-    init_db()
-    register(bot)
+def background_startup():
+    """Non-essential startup work, run while polling is already serving updates."""
+    try:
+        if sync_commands(bot):
+            print("[INFO] Bot commands updated.")
+    except Exception as e:
+        print("[WARN] Failed to set bot commands:", e)
+
+    try:
+        load_alert_registry()
+    except Exception as e:
+        # the scheduler still starts; its periodic reconcile retries the load
+        print("[WARN] Failed to load alert registry:", e)
 
     try:
+        from .scheduler import run_scheduler
         run_scheduler(bot)
     except Exception as e:
         print("[WARN] Failed to start scheduler:", e)
 
+    t = time.perf_counter()
+    try:
+        warm_caches(top_origins(WARM_ORIGINS))
+        print(f"[INFO] Caches warmed in {time.perf_counter() - t:.2f}s.")
+    except Exception as e:
+        print("[WARN] Cache warm-up failed:", e)
+
+
+def main():
+    if os.getenv("BOT_RUNTIME", "threads") == "asyncio":
+        from .aio import main as aio_main
+        return aio_main()
+
+    init_db()
+    register(bot)
+    bot.setup_middleware(FirstResponseTimer())
+    bot.setup_middleware(TraceMiddleware())
+
     signal.signal(signal.SIGINT, shutdown)
     signal.signal(signal.SIGTERM, shutdown)
 
-    print("[INFO] Bot started. Listening...")
+    threading.Thread(target=background_startup, daemon=True).start()
+
+    print(f"[INFO] Bot started in {time.perf_counter() - STARTED_AT:.2f}s. Listening...")
     bot.infinity_polling()
 
 
@@ -1,8 +1,15 @@
 # bot/db.py
 import sqlite3
-from typing import Optional, List
+from typing import Optional, List, Dict, Tuple
+from .models import Alert
+from .registry import alert_registry
+from .profiling import timed
 
 DB_FILE = "alerts.db"
+DEFAULT_PREFS = ("uzs", "uz")  # (currency, market)
+
+# user_id -> (currency, market); read-through cache, written by set_user_prefs
+_prefs_cache: Dict[int, Tuple[str, str]] = {}
 
 def get_conn():
     conn = sqlite3.connect(DB_FILE, check_same_thread=False)
@@ -34,8 +41,84 @@ def init_db():
             active INTEGER NOT NULL DEFAULT 1,
             created_at DATETIME DEFAULT CURRENT_TIMESTAMP
         )""")
+        # price history: codes and prices are integers; raw points are rolled
+        # up into hourly and then daily min/max/sum/count (see history.py)
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS iata_codes (
+            id INTEGER PRIMARY KEY,
+            code TEXT NOT NULL UNIQUE
+        )""")
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS price_raw (
+            origin INTEGER NOT NULL,
+            destination INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            depart INTEGER NOT NULL,
+            price INTEGER NOT NULL,
+            PRIMARY KEY (origin, destination, ts, depart)
+        ) WITHOUT ROWID""")
+        for table, period in (("price_hourly", "hour"), ("price_daily", "day")):
+            cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                origin INTEGER NOT NULL,
+                destination INTEGER NOT NULL,
+                {period} INTEGER NOT NULL,
+                min_price INTEGER NOT NULL,
+                max_price INTEGER NOT NULL,
+                sum_price INTEGER NOT NULL,
+                n INTEGER NOT NULL,
+                PRIMARY KEY (origin, destination, {period})
+            ) WITHOUT ROWID""")
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS user_prefs (
+            user_id INTEGER PRIMARY KEY,
+            currency TEXT NOT NULL,
+            market TEXT NOT NULL
+        )""")
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )""")
         conn.commit()
 
+# ---------- Meta ----------
+def get_meta(key: str) -> Optional[str]:
+    with get_conn() as conn:
+        row = conn.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+        return row["value"] if row else None
+
+def set_meta(key: str, value: str):
+    with get_conn() as conn:
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+def top_origins(limit: int = 5) -> List[str]:
+    """Origins with the most active alerts + enabled subscriptions, most used first."""
+    with get_conn() as conn:
+        rows = conn.execute("""
+            SELECT origin, COUNT(*) AS n FROM (
+                SELECT origin FROM alerts WHERE active=1
+                UNION ALL
+                SELECT origin FROM subscriptions WHERE enabled=1
+            ) GROUP BY origin ORDER BY n DESC LIMIT ?""", (limit,)).fetchall()
+        return [r["origin"] for r in rows]
+
+# ---------- User preferences ----------
+def get_user_prefs(user_id: int) -> Tuple[str, str]:
+    """(currency, market) for the user, DEFAULT_PREFS if never set."""
+    prefs = _prefs_cache.get(user_id)
+    if prefs is None:
+        with get_conn() as conn:
+            row = conn.execute("SELECT currency, market FROM user_prefs WHERE user_id=?", (user_id,)).fetchone()
+        prefs = _prefs_cache[user_id] = (row["currency"], row["market"]) if row else DEFAULT_PREFS
+    return prefs
+
+def set_user_prefs(user_id: int, currency: str, market: str):
+    with get_conn() as conn:
+        conn.execute("INSERT OR REPLACE INTO user_prefs (user_id, currency, market) VALUES (?, ?, ?)",
+                     (user_id, currency, market))
+    _prefs_cache[user_id] = (currency, market)
+
 # ---------- Subscriptions ----------
 def add_subscription(user_id: int, origin: str, hour: int = 10, minute: int = 0):
     with get_conn() as conn:
@@ -44,6 +127,7 @@ def add_subscription(user_id: int, origin: str, hour: int = 10, minute: int = 0)
             (user_id, origin, hour, minute)
         )
 
+@timed("sqlite.list_subscriptions")
 def list_subscriptions() -> List[sqlite3.Row]:
     with get_conn() as conn:
         return conn.execute("SELECT * FROM subscriptions WHERE enabled=1").fetchall()
@@ -62,30 +146,52 @@ def add_alert(user_id: int, origin: str, destination: str, target_price: Optiona
             "INSERT INTO alerts (user_id, origin, destination, target_price, last_price, active) VALUES (?, ?, ?, ?, ?, 1)",
             (user_id, origin, destination, target_price, last_price)
         )
-        return cur.lastrowid
+        alert_id = cur.lastrowid
+    alert_registry.put(Alert(alert_id, user_id, origin, destination, target_price, last_price))
+    return alert_id
 
 def list_alerts() -> List[sqlite3.Row]:
     with get_conn() as conn:
         return conn.execute("SELECT * FROM alerts WHERE active=1").fetchall()
 
+def load_alert_registry() -> int:
+    """(Re)load the in-memory alert registry from the table; returns the number of alerts that drifted."""
+    return alert_registry.reconcile(list_alerts)
+
 def list_user_alerts(user_id: int, active_only: bool = True) -> List[sqlite3.Row]:
     with get_conn() as conn:
         if active_only:
             return conn.execute("SELECT * FROM alerts WHERE user_id = ? AND active=1", (user_id,)).fetchall()
         return conn.execute("SELECT * FROM alerts WHERE user_id = ?", (user_id,)).fetchall()
 
+@timed("sqlite.update_alert_prices")
+def update_alert_prices(updates: List[Tuple[int, float]]):
+    """Batch form of update_alert_price: [(alert_id, new_price), ...] in one transaction."""
+    if not updates:
+        return
+    with get_conn() as conn:
+        conn.executemany("UPDATE alerts SET last_price=? WHERE id=?", [(p, i) for i, p in updates])
+    for alert_id, price in updates:
+        alert_registry.set_last_price(alert_id, price)
+
+@timed("sqlite.update_alert_price")
 def update_alert_price(alert_id: int, new_price: float):
     with get_conn() as conn:
         conn.execute("UPDATE alerts SET last_price=? WHERE id=?", (new_price, alert_id))
+    alert_registry.set_last_price(alert_id, new_price)
 
 def deactivate_alert(alert_id: int):
     with get_conn() as conn:
         conn.execute("UPDATE alerts SET active=0 WHERE id=?", (alert_id,))
+    alert_registry.remove(alert_id)
 
 def disable_alert(alert_id: int, user_id: int) -> bool:
     with get_conn() as conn:
         cur = conn.execute("UPDATE alerts SET active=0 WHERE id=? AND user_id=?", (alert_id, user_id))
-        return cur.rowcount > 0
+        ok = cur.rowcount > 0
+    if ok:
+        alert_registry.remove(alert_id)
+    return ok
 
 def alert_exists(user_id: int, origin: str, destination: str) -> bool:
     with get_conn() as conn:
@@ -0,0 +1,91 @@
+# bot/evaluator.py
+import math
+from typing import Dict, List, Mapping, NamedTuple, Sequence
+
+from .models import Alert
+
+_np = False  # numpy module, None when unavailable; False until first needed
+
+
+def load_numpy():
+    """numpy, imported on first use so it stays off the startup path; None if not installed."""
+    global _np
+    if _np is False:
+        try:
+            import numpy
+        except ImportError:  # numpy is optional; fall back to a plain loop
+            numpy = None
+        _np = numpy
+    return _np
+
+
+class Evaluation(NamedTuple):
+    triggered: Sequence[int]   # rows whose price dropped (and met the target, if any)
+    initialized: Sequence[int]  # rows that had no baseline yet
+    current: Sequence[float]    # current price per row (NaN where no deal)
+
+
+class AlertTable:
+    """
+    One origin's alerts as parallel arrays: row i is alerts[i].
+
+    dest_idx indexes into `destinations`; a missing target or baseline is NaN.
+    Baselines are updated in place via set_baseline(), so the table survives
+    across cycles until an alert for this origin is added or removed.
+    """
+
+    def __init__(self, alerts: Sequence[Alert]):
+        self.alerts: List[Alert] = list(alerts)
+        self.destinations: List[str] = sorted({a.destination for a in self.alerts})
+        self.row_of: Dict[int, int] = {a.id: i for i, a in enumerate(self.alerts)}
+        dest_pos = {d: i for i, d in enumerate(self.destinations)}
+        nan = math.nan
+        dest_idx = [dest_pos[a.destination] for a in self.alerts]
+        target = [nan if a.target_price is None else float(a.target_price) for a in self.alerts]
+        baseline = [nan if a.last_price is None else float(a.last_price) for a in self.alerts]
+        np = load_numpy()
+        if np is not None:
+            self.dest_idx = np.asarray(dest_idx, dtype=np.int32)
+            self.target = np.asarray(target, dtype=np.float64)
+            self.baseline = np.asarray(baseline, dtype=np.float64)
+        else:
+            self.dest_idx, self.target, self.baseline = dest_idx, target, baseline
+
+    def __len__(self):
+        return len(self.alerts)
+
+    def set_baseline(self, alert_id: int, price: float):
+        row = self.row_of.get(alert_id)
+        if row is not None:
+            self.baseline[row] = price
+
+    def evaluate(self, prices: Mapping[str, float]) -> Evaluation:
+        """Evaluate every alert against the destination -> current price book."""
+        book = [prices.get(d, math.nan) for d in self.destinations]
+        np = load_numpy()
+        if np is None:
+            return self._evaluate_loop(book)
+
+        current = np.asarray(book, dtype=np.float64)[self.dest_idx]
+        has_price = ~np.isnan(current)
+        no_baseline = np.isnan(self.baseline)
+        # comparisons against NaN are False, so rows without a price/baseline drop out
+        dropped = current < self.baseline
+        within_target = np.isnan(self.target) | (current <= self.target)
+        triggered = np.flatnonzero(dropped & within_target)
+        initialized = np.flatnonzero(has_price & no_baseline)
+        return Evaluation(triggered, initialized, current)
+
+    def _evaluate_loop(self, book: List[float]) -> Evaluation:
+        triggered, initialized, current = [], [], []
+        for row, di in enumerate(self.dest_idx):
+            price = book[di]
+            current.append(price)
+            if math.isnan(price):
+                continue
+            baseline, target = self.baseline[row], self.target[row]
+            if math.isnan(baseline):
+                initialized.append(row)
+            elif price < baseline and (math.isnan(target) or price <= target):
+                triggered.append(row)
+        return Evaluation(triggered, initialized, current)
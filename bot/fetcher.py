@@ -1,8 +1,12 @@
 # bot/fetcher.py
-import requests
+import time
 from datetime import datetime
 from urllib.parse import urlparse, parse_qs, urlencode
 from typing import Dict, Tuple, List, Any, Optional
+from .models import Offer, HotOffers, parse_offers
+from .state import offers_cache, offers_lock
+from . import history
+from .profiling import span, timed
 
 API_URL = "https://ariadne.aviasales.com/api/gql"
 DOMAINS_TO_TRY = ["https://www.aviasales.uz", "https://www.aviasales.ru"]
@@ -29,54 +33,95 @@ ULTRA_MINIMAL_QUERY = r"""query HotOffersV1($input: HotOffersV1Input!, $brand: B
 }"""
 CANDIDATE_PAYLOADS = [(SAFE_QUERY, "HotOffersV1"), (MINIMAL_QUERY, "HotOffersV1"), (ULTRA_MINIMAL_QUERY, "HotOffersV1")]
 
-def try_payloads(origin: str, currency: str = "uzs", market: str = "uz", max_directions: int = 50, locales: list = ["ru"]) -> Optional[Dict[str, Any]]:
+def build_payloads(origin: str, currency: str = "uzs", market: str = "uz", max_directions: int = 50, locales: list = ["ru"],
+                   one_way: bool = True, depart_date: Optional[str] = None, return_date: Optional[str] = None) -> List[Dict[str, Any]]:
+    """GraphQL payloads to try in order, richest query first."""
     base_input = {
         "origin_iata": origin,
         "origin_type": "CITY",
         "currency": currency,
         "market": market,
-        "one_way": True,
+        "one_way": one_way,
         "trip_class": "Y",
         "max_directions": max_directions,
         "group_by": "NONE",
         "badge_flag": "on",
         "tags_flag": None,
     }
+    if depart_date:
+        base_input["depart_date"] = depart_date
+    if return_date:
+        base_input["return_date"] = return_date
+    payloads = []
     for query, op_name in CANDIDATE_PAYLOADS:
         vars_ = {"brand": "AS", "input": base_input}
         if "$locales" in query:
             vars_["locales"] = locales
-        payload = {"query": query, "variables": vars_, "operation_name": op_name}
+        payloads.append({"query": query, "variables": vars_, "operation_name": op_name})
+    return payloads
+
+def extract_data(status: int, body: Any) -> Optional[Dict[str, Any]]:
+    """hot_offers_v1 block of a successful response, or None."""
+    if status != 200 or not isinstance(body, dict) or body.get("errors"):
+        return None
+    return (body.get("data") or {}).get("hot_offers_v1") or body.get("hot_offers_v1") or None
+
+def try_payloads(origin: str, currency: str = "uzs", market: str = "uz", max_directions: int = 50, locales: list = ["ru"],
+                 one_way: bool = True, depart_date: Optional[str] = None, return_date: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    import requests  # deferred: only needed once the first fetch happens
+
+    for payload in build_payloads(origin, currency, market, max_directions, locales, one_way, depart_date, return_date):
         try:
-            r = requests.post(API_URL, json=payload, timeout=12)
-            body = r.json()
+            with span("fetch.http"):
+                r = requests.post(API_URL, json=payload, timeout=12)
+            with span("fetch.json"):
+                body = r.json()
         except Exception:
             continue
-        if r.status_code != 200 or body.get("errors"):
-            continue
-        data = body.get("data", {}).get("hot_offers_v1") or body.get("hot_offers_v1")
+        data = extract_data(r.status_code, body)
         if data:
             return data
     return None
 
-def cheapest_per_destination(offers: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    best = {}
+def to_hot_offers(origin: str, currency: str, market: str, data: Dict[str, Any],
+                  one_way: bool = True, depart_date: Optional[str] = None) -> HotOffers:
+    """Parse a hot_offers_v1 block once, record it in the price history and the offers cache."""
+    with span("fetch.parse"):
+        cities_map, airlines_map = build_maps(data)
+        result = HotOffers(parse_offers(data.get("one_way_offers")), cities_map, airlines_map)
+    # the history holds one-way prices only; round-trip totals would skew its min/avg/max
+    if one_way:
+        history.record(origin, result.offers, currency)
+    if one_way and not depart_date:
+        with offers_lock:
+            offers_cache[(origin, currency, market)] = {"ts": time.time(), "data": result}
+    return result
+
+@timed("fetch_hot_offers")
+def fetch_hot_offers(origin: str, currency: str = "uzs", market: str = "uz", max_directions: int = 50, locales: list = ["ru"],
+                     one_way: bool = True, depart_date: Optional[str] = None, return_date: Optional[str] = None) -> Optional[HotOffers]:
+    """Fetch hot offers and parse them once into compact Offer records plus city/airline maps."""
+    data = try_payloads(origin, currency, market, max_directions=max_directions, locales=locales,
+                        one_way=one_way, depart_date=depart_date, return_date=return_date)
+    if not data:
+        return None
+    return to_hot_offers(origin, currency, market, data, one_way, depart_date)
+
+def cached_hot_offers(origin: str, currency: str = "uzs", market: str = "uz", max_age: Optional[float] = None) -> Optional[HotOffers]:
+    """Last fetched hot offers for origin, if any and not older than max_age seconds."""
+    with offers_lock:
+        entry = offers_cache.get((origin, currency, market))
+    if not entry or (max_age is not None and time.time() - entry["ts"] > max_age):
+        return None
+    return entry["data"]
+
+@timed("cheapest_per_destination")
+def cheapest_per_destination(offers: List[Offer]) -> List[Offer]:
+    best: Dict[str, Offer] = {}
     for o in offers:
-        p = o.get("price") or {}
-        dest = p.get("destination_city_iata")
-        if not dest:
-            segs = p.get("segments") or []
-            if segs:
-                legs = segs[0].get("flight_legs") or []
-                if legs:
-                    dest = legs[-1].get("destination")
-        if not dest:
-            continue
-        v = p.get("value")
-        if v is None:
-            continue
-        if dest not in best or v < (best[dest]["price"].get("value") or float("inf")):
-            best[dest] = o
+        cur = best.get(o.destination)
+        if cur is None or o.value < cur.value:
+            best[o.destination] = o
     return list(best.values())
 
 def build_maps(data: Dict[str, Any]) -> Tuple[Dict[str, str], Dict[str, str]]:
@@ -1,43 +1,40 @@
 # bot/formatter.py
-from typing import Dict, Any
+from typing import Dict
+from .models import Offer
+from .profiling import timed
 from .utils import simple_search_link, compact_price, format_date_ru
 
-def format_card_ru(o: Dict[str, Any], cities_map: Dict[str,str], airlines_map: Dict[str,str], origin: str) -> str:
-    p = o.get("price") or {}
-    old = o.get("old_price") or {}
-
-    dest = p.get("destination_city_iata") or "?"
+@timed("format_card_ru")
+def format_card_ru(o: Offer, cities_map: Dict[str,str], airlines_map: Dict[str,str], origin: str) -> str:
+    dest = o.destination or "?"
     dest_name = cities_map.get(dest, dest)
-    curr = p.get("currency") or "UZS"
+    curr = o.currency or "UZS"
 
-    compact = compact_price(p.get("value"), curr)
-    old_compact = compact_price(old.get("value"), curr) if old else "—"
+    compact = compact_price(o.value, curr)
+    old_compact = compact_price(o.old_value, curr) if o.old_value is not None else "—"
 
-    depart_date = p.get("depart_date")
+    depart_date = o.depart_date
     depart_display = format_date_ru(depart_date) or ""
 
-    segs = p.get("segments") or []
     origin_code = origin
     depart_time = arrival_time = None
-    if segs:
-        fl1 = segs[0].get("flight_legs") or []
-        fl2 = segs[-1].get("flight_legs") or []
-        if fl1:
-            origin_code = fl1[0].get("origin") or origin
-            depart_date = fl1[0].get("local_depart_date") or depart_date
-            depart_time = fl1[0].get("local_depart_time")
-        if fl2:
-            arrival_time = fl2[-1].get("local_arrival_time")
-            dest = fl2[-1].get("destination") or dest
-            dest_name = cities_map.get(dest, dest_name)
-
-    airline_code = p.get("main_airline")
+    first, last = o.first_leg, o.last_leg
+    if first:
+        origin_code = first.origin or origin
+        depart_date = first.depart_date or depart_date
+        depart_time = first.depart_time
+    if last:
+        arrival_time = last.arrival_time
+        dest = last.destination or dest
+        dest_name = cities_map.get(dest, dest_name)
+
+    airline_code = o.main_airline
     airline_name = airlines_map.get(airline_code, airline_code or "")
 
-    duration_minutes = p.get("duration")
+    duration_minutes = o.duration
     duration = "Неизвестно" if duration_minutes is None else f"{duration_minutes//60}ч {duration_minutes%60}м" if duration_minutes >= 60 else f"{duration_minutes}м"
 
-    stops = p.get("number_of_changes")
+    stops = o.number_of_changes
     if stops is None:
         stops_str = ""
     elif stops == 0:
@@ -47,9 +44,9 @@ def format_card_ru(o: Dict[str, Any], cities_map: Dict[str,str], airlines_map: D
     else:
         stops_str = f"{stops} пересадок"
 
-    ticket_link = p.get("ticket_link")
+    ticket_link = o.ticket_link
     if not ticket_link or not ticket_link.startswith("http"):
-        ticket_link = simple_search_link(origin_code, depart_date, dest, price_val=p.get("value"), currency=curr)
+        ticket_link = simple_search_link(origin_code, depart_date, dest, price_val=o.value, currency=curr)
 
     lines = [
          f"✈️  {dest_name} ({dest})",
@@ -1,9 +1,15 @@
 # bot/handlers.py
 from telebot import types
 from telebot.types import Message, CallbackQuery
-from .fetcher import try_payloads, build_maps, cheapest_per_destination
+from .fetcher import fetch_hot_offers, cached_hot_offers, cheapest_per_destination
+from .models import HotOffers
 from .formatter import format_card_ru
-from .state import sessions, cities_cache, CITIES_CACHE_TTL
+from . import history
+from .utils import format_date_ru
+from .state import sessions, cities_cache, state_lock, CITIES_CACHE_TTL, OFFERS_CACHE_TTL
+from .throttle import throttled, upstream_budget, stats as throttle_stats
+from . import profiling
+from .rates import convert, convert_offers, market_currency, MARKET_CURRENCY, SUPPORTED_CURRENCIES
 from .db import (
     add_subscription,
     alert_exists,
@@ -11,13 +17,25 @@ from .db import (
     list_user_alerts,
     disable_alert,
     get_conn,
+    get_meta,
+    set_meta,
+    get_user_prefs,
+    set_user_prefs,
 )
+import hashlib
+import json
+import os
 import time
+from typing import Optional
 
 PAGE_SIZE = 5
 DEFAULT_ORIGIN = "TAS"
 DEFAULT_CURRENCY = "uzs"
 DEFAULT_MARKET = "uz"
+HISTORY_LINES = 14
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").replace(",", " ").split() if x.isdigit()}
+BUSY_TEXT = "⏳ Слишком много запросов, попробуйте чуть позже."
+EMPTY_OFFERS = HotOffers([], {}, {})
 
 
 def _format_price(amount, currency=DEFAULT_CURRENCY):
@@ -28,6 +46,11 @@ def _format_price(amount, currency=DEFAULT_CURRENCY):
         return f"{amount} {currency}"
 
 
+def _format_user_price(amount, currency):
+    """Format a price stored in DEFAULT_CURRENCY in the user's currency."""
+    return _format_price(convert(amount, DEFAULT_CURRENCY, currency), currency)
+
+
 def make_markup_for_page(idx, total):
     kb = types.InlineKeyboardMarkup()
     if total <= 1:
@@ -51,27 +74,68 @@ def paginate(items, header="", footer=""):
     return pages
 
 
-def safe_fetch(origin, limit=50):
+def safe_fetch(origin, user_id, chat_id, market=DEFAULT_MARKET, limit=50) -> Optional[HotOffers]:
+    """
+    Offers for origin in the market's own currency: from the cache while fresh,
+    otherwise fetched upstream if admission control lets the user/chat through.
+    When throttled, stale cached offers are served instead; None means throttled
+    with nothing cached.
+    """
+    currency = market_currency(market)
+    cached = cached_hot_offers(origin, currency, market, max_age=OFFERS_CACHE_TTL)
+    if cached is not None:
+        return cached
+    if throttled(user_id, chat_id):
+        stale = cached_hot_offers(origin, currency, market)
+        if stale is not None:
+            throttle_stats["served_stale"] += 1
+        return stale
     try:
-        data = try_payloads(origin, DEFAULT_CURRENCY, DEFAULT_MARKET, max_directions=limit, locales=["ru"])
-        return data or {}
+        data = fetch_hot_offers(origin, currency, market, max_directions=limit, locales=["ru"])
+        return data or EMPTY_OFFERS
     except Exception:
-        return {}
+        return EMPTY_OFFERS
+
+
+COMMANDS = [
+    ("start", "✅ Запустить бота"),
+    ("help", "♻️ Помощь"),
+    ("deals", "✈ Лучшие предложения"),
+    ("cities", "🌍 Список городов"),
+    ("subscribe", "🔔 Подписка на ежедневные предложения"),
+    ("unsubscribe", "❌ Отписка от ежедневных предложений"),
+    ("calendar", "📅 Календарь цен на даты"),
+    ("history", "📈 История цен"),
+    ("currency", "💱 Валюта и рынок"),
+    ("alert", "💰 Создать оповещение о цене"),
+    ("myalerts", "📋 Мои оповещения"),
+]
+
+
+def sync_commands(bot) -> bool:
+    """Call set_my_commands only when COMMANDS changed since the last run; returns True if sent."""
+    digest = hashlib.sha256(json.dumps(COMMANDS, ensure_ascii=False).encode()).hexdigest()
+    if get_meta("commands_hash") == digest:
+        return False
+    bot.set_my_commands([types.BotCommand(c, d) for c, d in COMMANDS])
+    set_meta("commands_hash", digest)
+    return True
+
+
+def warm_caches(origins):
+    """Prefetch hot offers for the given origins (and the /cities list) into the caches."""
+    for origin in dict.fromkeys([DEFAULT_ORIGIN, *origins]):
+        upstream_budget.consume()
+        try:
+            data = fetch_hot_offers(origin, DEFAULT_CURRENCY, DEFAULT_MARKET, max_directions=50, locales=["ru"])
+        except Exception:
+            data = None
+        if data and origin == DEFAULT_ORIGIN and data.cities:
+            with state_lock:
+                cities_cache.update({"data": data.cities, "ts": time.time()})
 
 
 def register(bot):
-    # -------------------- Bot commands --------------------
-    bot.set_my_commands([
-        types.BotCommand("start", "✅ Запустить бота"),
-        types.BotCommand("help", "♻️ Помощь"),
-        types.BotCommand("deals", "✈ Лучшие предложения"),
-        types.BotCommand("cities", "🌍 Список городов"),
-        types.BotCommand("subscribe", "🔔 Подписка на ежедневные предложения"),
-        types.BotCommand("unsubscribe", "❌ Отписка от ежедневных предложений"),
-        types.BotCommand("alert", "💰 Создать оповещение о цене"),
-        types.BotCommand("myalerts", "📋 Мои оповещения"),
-    ])
-
     # -------------------- Start / Help --------------------
     @bot.message_handler(commands=["start", "help"])
     def cmd_start(msg: Message):
@@ -84,6 +148,9 @@ def register(bot):
             "🌍 /cities — список городов\n"
             "🔔 /subscribe IATA [HH] [MM] — ежедневные предложения\n"
             "❌ /unsubscribe — отменить подписку\n"
+            "📅 /calendar ORIGIN DESTINATION С ПО [RT] — цены по датам\n"
+            "📈 /history ORIGIN DESTINATION [ДНЕЙ] — история цен\n"
+            "💱 /currency [ВАЛЮТА] [РЫНОК] — валюта цен\n"
             "💰 /alert ORIGIN DESTINATION [Цель] — оповещение о цене\n"
             "📋 /myalerts — активные оповещения"
         )
@@ -105,14 +172,20 @@ def register(bot):
     @bot.message_handler(commands=["cities"])
     def cmd_cities(msg: Message):
         now = time.time()
-        if not cities_cache["data"] or now - cities_cache["ts"] > CITIES_CACHE_TTL:
-            data = safe_fetch(DEFAULT_ORIGIN)
-            cities_map, _ = build_maps(data)
-            if not cities_map:
+        with state_lock:
+            cities_map, cached_ts = cities_cache["data"], cities_cache["ts"]
+        if not cities_map or now - cached_ts > CITIES_CACHE_TTL:
+            data = safe_fetch(DEFAULT_ORIGIN, msg.from_user.id, msg.chat.id)
+            if data is None:
+                bot.reply_to(msg, BUSY_TEXT)
+                return
+            cities_map = data.cities
+            if cities_map:
+                with state_lock:
+                    cities_cache.update({"data": cities_map, "ts": now})
+            else:
+                # short fallback list; not cached, so the next call retries upstream
                 cities_map = {"TAS": "Ташкент", "MOW": "Москва", "IST": "Стамбул", "DXB": "Дубай", "AYT": "Анталья"}
-            cities_cache.update({"data": cities_map, "ts": now})
-        else:
-            cities_map = cities_cache["data"]
 
         items = sorted([f"✈ {iata} — {name}" for iata, name in cities_map.items()])
         pages = paginate(items, header="🌍 Доступные города и IATA-коды\n\n", footer="\n\nЧтобы искать билеты: /deals TAS")
@@ -123,8 +196,9 @@ def register(bot):
         status = bot.send_message(msg.chat.id, "Генерирую список городов...", disable_web_page_preview=True)
         bot.edit_message_text(pages[0], msg.chat.id, status.message_id, parse_mode="Markdown",
                               disable_web_page_preview=True, reply_markup=make_markup_for_page(0, len(pages)))
-        sessions[msg.from_user.id] = {"type": "cities", "pages": pages, "page": 0,
-                                      "message_id": status.message_id, "chat_id": msg.chat.id}
+        with state_lock:
+            sessions[msg.from_user.id] = {"type": "cities", "pages": pages, "page": 0,
+                                          "message_id": status.message_id, "chat_id": msg.chat.id}
 
     # -------------------- Deals --------------------
     @bot.message_handler(commands=["deals"])
@@ -133,26 +207,144 @@ def register(bot):
         origin = parts[1].upper() if len(parts) >= 2 else DEFAULT_ORIGIN
         limit = min(100, max(1, int(parts[2]))) if len(parts) >= 3 else 20
 
+        currency, market = get_user_prefs(msg.from_user.id)
         status_msg = bot.send_message(msg.chat.id, f"Ищу предложения из {origin}...", disable_web_page_preview=True)
-        data = safe_fetch(origin)
-        offers = data.get("one_way_offers") or []
+        data = safe_fetch(origin, msg.from_user.id, msg.chat.id, market=market)
+        if data is None:
+            bot.edit_message_text(BUSY_TEXT, msg.chat.id, status_msg.message_id)
+            return
+        offers, cities_map, airlines_map = data
         if not offers:
             bot.edit_message_text("Предложения не найдены.", msg.chat.id, status_msg.message_id)
             return
 
-        cities_map, airlines_map = build_maps(data)
         best = cheapest_per_destination(offers)
-        best.sort(key=lambda o: (o.get("price") or {}).get("value") or float("inf"))
+        best.sort(key=lambda o: o.value)
 
-        cards = [format_card_ru(item, cities_map, airlines_map, origin) for item in best[:limit]]
+        cards = [format_card_ru(item, cities_map, airlines_map, origin) for item in convert_offers(best[:limit], currency)]
         pages = paginate(cards, header=f"🌍 Предложения из {cities_map.get(origin, origin)} ({origin})\n\n",
                          footer="\n\nЧтобы изменить город, используйте: /deals IST")
 
         bot.edit_message_text(pages[0], msg.chat.id, status_msg.message_id, parse_mode="Markdown",
                               disable_web_page_preview=True, reply_markup=make_markup_for_page(0, len(pages)))
-        sessions[msg.from_user.id] = {"type": "deals", "pages": pages, "page": 0,
-                                      "message_id": status_msg.message_id, "chat_id": msg.chat.id,
-                                      "meta": {"origin": origin}}
+        with state_lock:
+            sessions[msg.from_user.id] = {"type": "deals", "pages": pages, "page": 0,
+                                          "message_id": status_msg.message_id, "chat_id": msg.chat.id,
+                                          "meta": {"origin": origin}}
+
+    # -------------------- Calendar --------------------
+    @bot.message_handler(commands=["calendar"])
+    def cmd_calendar(msg: Message):
+        from .search import price_calendar, parse_day, DEFAULT_NIGHTS, MAX_WINDOW_DAYS
+
+        parts = msg.text.strip().split()
+        start = parse_day(parts[3]) if len(parts) >= 5 else None
+        # the end date is resolved relative to the start, so 29.02 01.03 stays one range
+        end = parse_day(parts[4], after=start) if start else None
+        if not start or not end:
+            bot.reply_to(msg, "Использование: /calendar ORIGIN DESTINATION ДД.ММ ДД.ММ [RT] [НОЧЕЙ]")
+            return
+        if end < start:
+            bot.reply_to(msg, "Дата окончания раньше даты начала.")
+            return
+
+        origin, destination = parts[1].upper(), parts[2].upper()
+        round_trip = len(parts) >= 6 and parts[5].upper() == "RT"
+        nights = int(parts[6]) if round_trip and len(parts) >= 7 and parts[6].isdigit() else DEFAULT_NIGHTS
+
+        currency, market = get_user_prefs(msg.from_user.id)
+        status_msg = bot.send_message(msg.chat.id, f"Собираю цены {origin} → {destination}...", disable_web_page_preview=True)
+        # every uncached day costs the user, the chat and the upstream budget one token
+        cells, skipped = price_calendar(origin, destination, start, end, round_trip=round_trip, nights=nights,
+                                        currency=market_currency(market), market=market,
+                                        admit=lambda: not throttled(msg.from_user.id, msg.chat.id))
+        cells = [(day, convert_offers([o], currency)[0] if o else None) for day, o in cells]
+        priced = [o.value for _, o in cells if o]
+        if not priced:
+            text = BUSY_TEXT if skipped else "Цены на эти даты не найдены."
+            bot.edit_message_text(text, msg.chat.id, status_msg.message_id)
+            return
+
+        best = min(priced)
+        skipped = set(skipped)
+        trip = f"туда-обратно, {nights} ноч." if round_trip else "в одну сторону"
+        lines = [f"📅 {origin} → {destination} ({trip})\n"]
+        for day, o in cells:
+            price = _format_price(o.value, o.currency or DEFAULT_CURRENCY) if o else "⏳" if day in skipped else "—"
+            mark = " 🔥" if o and o.value == best else ""
+            lines.append(f"{format_date_ru(day.isoformat())}: {price}{mark}")
+        if skipped:
+            lines.append("\n⏳ — цены ещё не загружены, повторите запрос чуть позже.")
+        if (end - start).days + 1 > MAX_WINDOW_DAYS:
+            lines.append(f"\nПоказаны первые {MAX_WINDOW_DAYS} дней периода.")
+        bot.edit_message_text("\n".join(lines), msg.chat.id, status_msg.message_id, disable_web_page_preview=True)
+
+    # -------------------- History --------------------
+    @bot.message_handler(commands=["history"])
+    def cmd_history(msg: Message):
+        parts = msg.text.strip().split()
+        if len(parts) < 3:
+            bot.reply_to(msg, "Использование: /history ORIGIN DESTINATION [ДНЕЙ]")
+            return
+
+        origin, destination = parts[1].upper(), parts[2].upper()
+        days = min(365, max(1, int(parts[3]))) if len(parts) >= 4 and parts[3].isdigit() else 30
+        stats = history.window_stats(origin, destination, days)
+        if not stats:
+            bot.reply_to(msg, f"Нет сохранённых цен для {origin} → {destination}.")
+            return
+
+        low, avg, high, _ = stats
+        currency, _ = get_user_prefs(msg.from_user.id)
+
+        def fmt(amount):
+            return _format_price(convert(amount, history.HISTORY_CURRENCY, currency), currency)
+
+        lines = [
+            f"📈 {origin} → {destination} за {days} дн.",
+            f"Минимум: {fmt(low)}",
+            f"В среднем: {fmt(avg)}",
+            f"Максимум: {fmt(high)}",
+            "",
+        ]
+        for day, price in history.daily_minimums(origin, destination, days)[-HISTORY_LINES:]:
+            lines.append(f"{format_date_ru(day.isoformat())}: {fmt(price)}")
+        bot.reply_to(msg, "\n".join(lines))
+
+    # -------------------- Currency --------------------
+    @bot.message_handler(commands=["currency"])
+    def cmd_currency(msg: Message):
+        parts = msg.text.strip().split()
+        currency, market = get_user_prefs(msg.from_user.id)
+        if len(parts) < 2:
+            bot.reply_to(msg, f"💱 Валюта: {currency.upper()}, рынок: {market}\n"
+                              f"Изменить: /currency ВАЛЮТА [РЫНОК]\n"
+                              f"Валюты: {', '.join(c.upper() for c in SUPPORTED_CURRENCIES)}\n"
+                              f"Рынки: {', '.join(MARKET_CURRENCY)}")
+            return
+
+        new_currency = parts[1].lower()
+        new_market = parts[2].lower() if len(parts) >= 3 else market
+        if new_currency not in SUPPORTED_CURRENCIES or new_market not in MARKET_CURRENCY:
+            bot.reply_to(msg, "❗ Неизвестная валюта или рынок. /currency — список.")
+            return
+        set_user_prefs(msg.from_user.id, new_currency, new_market)
+        bot.reply_to(msg, f"✅ Цены будут показаны в {new_currency.upper()} (рынок {new_market}).")
+
+    # -------------------- Profiling (admins only) --------------------
+    @bot.message_handler(commands=["profile"], func=lambda m: m.from_user.id in ADMIN_IDS)
+    def cmd_profile(msg: Message):
+        parts = msg.text.strip().split()
+        try:
+            cfg = profiling.configure(
+                mode=parts[1].lower() if len(parts) >= 2 else None,
+                threshold_ms=int(parts[2]) if len(parts) >= 3 else None,
+            )
+        except ValueError:
+            bot.reply_to(msg, f"Использование: /profile [{'|'.join(profiling.MODES)}] [ПОРОГ_МС]")
+            return
+        bot.reply_to(msg, f"Профилирование: {cfg['mode']}, порог {cfg['threshold_ms']} мс, "
+                          f"дампы в {profiling.TRACE_DIR}/", parse_mode=None)
 
     # -------------------- Subscribe --------------------
     @bot.message_handler(commands=["subscribe"])
@@ -179,27 +371,28 @@ def register(bot):
             return
 
         origin, destination = parts[1].upper(), parts[2].upper()
-        target_price = float(parts[3]) if len(parts) >= 4 else None
+        currency, _ = get_user_prefs(msg.from_user.id)
+        # alerts are tracked on the default market, so prices are stored in its currency
+        target_price = convert(float(parts[3]), currency, DEFAULT_CURRENCY) if len(parts) >= 4 else None
 
         if alert_exists(msg.from_user.id, origin, destination):
             bot.reply_to(msg, f"⚠ Уже есть активное оповещение для {origin} → {destination}. /myalerts")
             return
 
         last_price = None
-        data = safe_fetch(origin)
-        offers = data.get("one_way_offers") or []
-        for o in cheapest_per_destination(offers):
-            p = o.get("price") or {}
-            if p.get("destination_city_iata") == destination:
-                last_price = p.get("value")
+        # a throttled fetch just leaves the baseline empty; the alerts job fills it in
+        data = safe_fetch(origin, msg.from_user.id, msg.chat.id) or EMPTY_OFFERS
+        for o in cheapest_per_destination(data.offers):
+            if o.destination == destination:
+                last_price = o.value
                 break
 
         alert_id = add_alert(msg.from_user.id, origin, destination, target_price, last_price)
 
         text = f"✅ Оповещение установлено: {origin} → {destination}"
         if target_price is not None:
-            text += f" (цель ≤ {_format_price(target_price)})"
-        text += f"\n💰 Текущая цена: {_format_price(last_price) if last_price else 'N/A'}"
+            text += f" (цель ≤ {_format_user_price(target_price, currency)})"
+        text += f"\n💰 Текущая цена: {_format_user_price(last_price, currency) if last_price else 'N/A'}"
         text += f"\nID оповещения: {alert_id}"
         bot.reply_to(msg, text)
 
@@ -210,13 +403,14 @@ def register(bot):
         if not alerts:
             bot.reply_to(msg, "У вас нет активных оповещений.")
             return
+        currency, _ = get_user_prefs(msg.from_user.id)
         for a in alerts:
             kb = types.InlineKeyboardMarkup()
             kb.add(types.InlineKeyboardButton("❌ Удалить", callback_data=f"delalert_{a['id']}"))
             bot.send_message(msg.chat.id,
                              f"🔔 ID {a['id']} — {a['origin']} → {a['destination']}\n"
-                             f"Базовая: {_format_price(a['last_price']) if a['last_price'] else 'N/A'} | "
-                             f"Цель: {_format_price(a['target_price']) if a['target_price'] else '—'}",
+                             f"Базовая: {_format_user_price(a['last_price'], currency) if a['last_price'] else 'N/A'} | "
+                             f"Цель: {_format_user_price(a['target_price'], currency) if a['target_price'] else '—'}",
                              reply_markup=kb)
 
     # -------------------- Callbacks --------------------
@@ -233,16 +427,25 @@ def register(bot):
 
     @bot.callback_query_handler(func=lambda c: c.data.startswith("nav_"))
     def cb_nav(call: CallbackQuery):
-        uid, sess = call.from_user.id, sessions.get(call.from_user.id)
+        action = call.data.split("_")[1]
+        # claim the page move under the lock so two quick taps can't both apply
+        with state_lock:
+            sess = sessions.get(call.from_user.id)
+            if sess:
+                cur, total = sess.get("page", 0), len(sess["pages"])
+                new = min(total - 1, cur + 1) if action == "NEXT" else max(0, cur - 1)
+                sess["page"] = new
         if not sess:
             return bot.answer_callback_query(call.id, "Сессия не найдена. /deals или /cities снова.")
-        action, cur = call.data.split("_")[1], sess.get("page", 0)
-        total = len(sess["pages"])
-        new = min(total - 1, cur + 1) if action == "NEXT" else max(0, cur - 1)
         if new == cur:
             return bot.answer_callback_query(call.id)
-        bot.edit_message_text(sess["pages"][new], sess["chat_id"], sess["message_id"],
-                              parse_mode="Markdown", disable_web_page_preview=True,
-                              reply_markup=make_markup_for_page(new, total))
-        sess["page"] = new
+        try:
+            bot.edit_message_text(sess["pages"][new], sess["chat_id"], sess["message_id"],
+                                  parse_mode="Markdown", disable_web_page_preview=True,
+                                  reply_markup=make_markup_for_page(new, total))
+        except Exception:
+            with state_lock:
+                if sess.get("page") == new:
+                    sess["page"] = cur
+            raise
         bot.answer_callback_query(call.id)
@@ -0,0 +1,154 @@
+# bot/history.py
+import threading
+import time
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .db import get_conn
+from .models import Offer
+from .profiling import timed
+
+HISTORY_CURRENCY = "uzs"        # prices are stored in this currency only
+RAW_KEEP = 2 * 86400            # raw points older than this are rolled into hourly rows
+HOURLY_KEEP = 30 * 86400        # hourly rows older than this are rolled into daily rows
+DAILY_KEEP = 365 * 86400        # daily rows older than this are deleted
+
+_EPOCH = date(1970, 1, 1)
+
+_codes: Dict[str, int] = {}
+_pending: List[Tuple[str, str, Optional[str], float, int]] = []
+_lock = threading.Lock()
+
+
+def _code_id(conn, code: str) -> int:
+    cid = _codes.get(code)
+    if cid is None:
+        conn.execute("INSERT OR IGNORE INTO iata_codes (code) VALUES (?)", (code,))
+        cid = conn.execute("SELECT id FROM iata_codes WHERE code=?", (code,)).fetchone()["id"]
+        _codes[code] = cid
+    return cid
+
+
+def _day_number(ymd: Optional[str]) -> int:
+    """'YYYY-MM-DD' -> days since 1970-01-01 (0 when unknown)."""
+    try:
+        return (datetime.strptime(ymd, "%Y-%m-%d").date() - _EPOCH).days
+    except (TypeError, ValueError):
+        return 0
+
+
+def record(origin: str, offers: Iterable[Offer], currency: str, ts: Optional[int] = None):
+    """Queue the fetched prices; they reach SQLite on the next flush()."""
+    if currency != HISTORY_CURRENCY:
+        return
+    ts = int(ts or time.time())
+    rows = [(origin, o.destination, o.depart_date, o.value, ts) for o in offers]
+    with _lock:
+        _pending.extend(rows)
+
+
+@timed("sqlite.history_flush")
+def flush() -> int:
+    """Write all queued prices in one transaction; returns how many points were written."""
+    with _lock:
+        rows, _pending[:] = list(_pending), []
+    if not rows:
+        return 0
+    try:
+        with get_conn() as conn:
+            conn.executemany(
+                "INSERT INTO price_raw (origin, destination, ts, depart, price) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (origin, destination, ts, depart) DO UPDATE SET price=min(price, excluded.price)",
+                [(_code_id(conn, o), _code_id(conn, d), ts, _day_number(dep), int(round(p))) for o, d, dep, p, ts in rows],
+            )
+    except Exception:
+        # the transaction was rolled back, including any codes inserted by
+        # _code_id; forget the cached ids and requeue the batch
+        _codes.clear()
+        with _lock:
+            _pending[:0] = rows
+        raise
+    return len(rows)
+
+
+def downsample(now: Optional[int] = None):
+    """Roll raw points into hourly and hourly into daily min/max rows, then apply retention."""
+    now = int(now or time.time())
+    raw_cut = (now - RAW_KEEP) // 3600 * 3600
+    hourly_cut = (now - HOURLY_KEEP) // 86400 * 86400
+    with get_conn() as conn:
+        conn.execute("""
+            INSERT INTO price_hourly (origin, destination, hour, min_price, max_price, sum_price, n)
+            SELECT origin, destination, ts / 3600 * 3600, min(price), max(price), sum(price), count(*)
+            FROM price_raw WHERE ts < ? GROUP BY 1, 2, 3
+            ON CONFLICT (origin, destination, hour) DO UPDATE SET
+                min_price=min(min_price, excluded.min_price), max_price=max(max_price, excluded.max_price),
+                sum_price=sum_price + excluded.sum_price, n=n + excluded.n""", (raw_cut,))
+        conn.execute("DELETE FROM price_raw WHERE ts < ?", (raw_cut,))
+        conn.execute("""
+            INSERT INTO price_daily (origin, destination, day, min_price, max_price, sum_price, n)
+            SELECT origin, destination, hour / 86400 * 86400, min(min_price), max(max_price), sum(sum_price), sum(n)
+            FROM price_hourly WHERE hour < ? GROUP BY 1, 2, 3
+            ON CONFLICT (origin, destination, day) DO UPDATE SET
+                min_price=min(min_price, excluded.min_price), max_price=max(max_price, excluded.max_price),
+                sum_price=sum_price + excluded.sum_price, n=n + excluded.n""", (hourly_cut,))
+        conn.execute("DELETE FROM price_hourly WHERE hour < ?", (hourly_cut,))
+        conn.execute("DELETE FROM price_daily WHERE day < ?", (now - DAILY_KEEP,))
+
+
+# all tiers as (time, min, max, sum, n) rows; a point lives in exactly one tier
+_WINDOW_SQL = """
+    SELECT ts AS t, price AS mn, price AS mx, price AS sm, 1 AS n FROM price_raw
+        WHERE origin=:o AND destination=:d AND ts >= :since
+    UNION ALL
+    SELECT hour, min_price, max_price, sum_price, n FROM price_hourly
+        WHERE origin=:o AND destination=:d AND hour >= :since
+    UNION ALL
+    SELECT day, min_price, max_price, sum_price, n FROM price_daily
+        WHERE origin=:o AND destination=:d AND day >= :since
+"""
+
+
+def _route_params(conn, origin: str, destination: str, days: int) -> Optional[dict]:
+    o, d = _codes.get(origin), _codes.get(destination)
+    if o is None or d is None:
+        rows = conn.execute("SELECT id, code FROM iata_codes WHERE code IN (?, ?)", (origin, destination)).fetchall()
+        ids = {r["code"]: r["id"] for r in rows}
+        o, d = ids.get(origin), ids.get(destination)
+        if o is None or d is None:
+            return None
+    return {"o": o, "d": d, "since": int(time.time()) - days * 86400}
+
+
+@timed("sqlite.history_window")
+def window_stats(origin: str, destination: str, days: int = 30,
+                 flush_pending: bool = True) -> Optional[Tuple[int, float, int, int]]:
+    """
+    (min, avg, max, points) of stored prices for the route over the last `days`, or None.
+
+    Queued points are flushed first unless `flush_pending` is False (the alerts
+    cycle, which flushes once at its end).
+    """
+    if flush_pending:
+        flush()
+    with get_conn() as conn:
+        params = _route_params(conn, origin, destination, days)
+        if params is None:
+            return None
+        row = conn.execute(f"SELECT min(mn), sum(sm), max(mx), sum(n) FROM ({_WINDOW_SQL})", params).fetchone()
+    if not row or not row[3]:
+        return None
+    return row[0], row[1] / row[3], row[2], row[3]
+
+
+def daily_minimums(origin: str, destination: str, days: int = 30) -> List[Tuple[date, int]]:
+    """Lowest stored price per calendar day (UTC) for the route over the last `days`."""
+    flush()
+    with get_conn() as conn:
+        params = _route_params(conn, origin, destination, days)
+        if params is None:
+            return []
+        rows = conn.execute(
+            f"SELECT t / 86400 AS day, min(mn) FROM ({_WINDOW_SQL}) GROUP BY day ORDER BY day", params
+        ).fetchall()
+    return [(date.fromordinal(_EPOCH.toordinal() + r[0]), r[1]) for r in rows]
@@ -0,0 +1,129 @@
+# bot/models.py
+import sys
+from typing import NamedTuple, Optional, Tuple, Dict, Any, List
+
+
+def _code(value) -> Optional[str]:
+    """Intern short repeated strings (IATA codes, currencies, dates) so offers share them."""
+    if isinstance(value, str) and value:
+        return sys.intern(value)
+    return None
+
+
+class Leg(NamedTuple):
+    origin: Optional[str]
+    destination: Optional[str]
+    depart_date: Optional[str]
+    depart_time: Optional[str]
+    arrival_time: Optional[str]
+
+
+class Segment(NamedTuple):
+    legs: Tuple[Leg, ...]
+
+
+class Offer(NamedTuple):
+    destination: str
+    value: float
+    currency: Optional[str]
+    old_value: Optional[float]
+    depart_date: Optional[str]
+    main_airline: Optional[str]
+    duration: Optional[int]
+    number_of_changes: Optional[int]
+    ticket_link: Optional[str]
+    segments: Tuple[Segment, ...] = ()
+
+    @property
+    def first_leg(self) -> Optional[Leg]:
+        if self.segments and self.segments[0].legs:
+            return self.segments[0].legs[0]
+        return None
+
+    @property
+    def last_leg(self) -> Optional[Leg]:
+        if self.segments and self.segments[-1].legs:
+            return self.segments[-1].legs[-1]
+        return None
+
+
+class HotOffers(NamedTuple):
+    offers: List[Offer]
+    cities: Dict[str, str]
+    airlines: Dict[str, str]
+
+
+def _parse_leg(raw: Dict[str, Any]) -> Leg:
+    return Leg(
+        _code(raw.get("origin")),
+        _code(raw.get("destination")),
+        _code(raw.get("local_depart_date")),
+        _code(raw.get("local_depart_time")),
+        _code(raw.get("local_arrival_time")),
+    )
+
+
+def _parse_segments(raw_segments) -> Tuple[Segment, ...]:
+    segments = []
+    for seg in raw_segments or ():
+        legs = tuple(_parse_leg(l) for l in (seg or {}).get("flight_legs") or () if l)
+        segments.append(Segment(legs))
+    return tuple(segments)
+
+
+def parse_offer(raw: Dict[str, Any]) -> Optional[Offer]:
+    """Convert one raw GraphQL offer into an Offer, or None if it has no destination/price."""
+    p = raw.get("price") or {}
+    value = p.get("value")
+    if value is None:
+        return None
+    segments = _parse_segments(p.get("segments"))
+
+    dest = p.get("destination_city_iata")
+    if not dest and segments and segments[0].legs:
+        dest = segments[0].legs[-1].destination
+    if not dest:
+        return None
+
+    old_value = (raw.get("old_price") or {}).get("value")
+    return Offer(
+        _code(dest),
+        value,
+        _code(p.get("currency")),
+        old_value,
+        _code(p.get("depart_date")),
+        _code(p.get("main_airline")),
+        p.get("duration"),
+        p.get("number_of_changes"),
+        p.get("ticket_link"),
+        segments,
+    )
+
+
+def parse_offers(raw_offers) -> List[Offer]:
+    offers = []
+    for raw in raw_offers or ():
+        o = parse_offer(raw or {})
+        if o is not None:
+            offers.append(o)
+    return offers
+
+
+class Alert(NamedTuple):
+    id: int
+    user_id: int
+    origin: str
+    destination: str
+    target_price: Optional[float]
+    last_price: Optional[float]
+
+    @classmethod
+    def from_row(cls, row) -> "Alert":
+        return cls(
+            int(row["id"]),
+            row["user_id"],
+            sys.intern(row["origin"]),
+            sys.intern(row["destination"]),
+            row["target_price"],
+            row["last_price"],
+        )
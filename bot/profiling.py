@@ -0,0 +1,177 @@
+# bot/profiling.py
+# Tracing spans around the hot paths. A trace covers one unit of work (alert
+# cycle, subscription job, handler invocation); if it runs longer than the
+# threshold it is dumped to TRACE_DIR in collapsed-stack format
+# ("a;b;c <value>" per line), readable by flamegraph.pl / speedscope.
+# Modes: off, spans (span timings), sample (plus periodic stack samples).
+# The open trace and span path live in context variables, so they follow a
+# unit of work across asyncio tasks and asyncio.to_thread() as well as threads.
+# Spans that ran concurrently are summed, so a path can exceed the trace time.
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, List, Optional, Tuple
+
+MODES = ("off", "spans", "sample")
+TRACE_DIR = os.getenv("TRACE_DIR", "traces")
+SAMPLE_INTERVAL = 0.005  # seconds
+
+_config = {
+    "mode": os.getenv("PROFILE_MODE", "off") if os.getenv("PROFILE_MODE") in MODES else "off",
+    "threshold_ms": int(os.getenv("PROFILE_THRESHOLD_MS", "2000")),
+}
+_current: ContextVar[Optional["_Trace"]] = ContextVar("profiling_trace", default=None)
+_path: ContextVar[str] = ContextVar("profiling_path", default="")
+
+
+def configure(mode: Optional[str] = None, threshold_ms: Optional[int] = None) -> Dict[str, object]:
+    """Change mode/threshold at runtime; returns the resulting config."""
+    if mode is not None:
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}")
+        _config["mode"] = mode
+    if threshold_ms is not None:
+        _config["threshold_ms"] = max(0, int(threshold_ms))
+    return dict(_config)
+
+
+class _Sampler(threading.Thread):
+    """Samples one thread's Python stack at a fixed interval."""
+
+    def __init__(self, thread_id: int):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.stacks: Counter = Counter()
+        self._halt = threading.Event()
+
+    def run(self):
+        while not self._halt.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self) -> Counter:
+        self._halt.set()
+        self.join()
+        return self.stacks
+
+
+class _Trace:
+    def __init__(self, name: str):
+        self.name = name
+        self.spans: List[Tuple[str, float]] = []
+        self.sampler: Optional[_Sampler] = None
+        self.t0 = time.perf_counter()
+
+
+def start_trace(name: str) -> bool:
+    """Open a trace in this context; returns False if tracing is off or one is already open."""
+    if _config["mode"] == "off" or _current.get() is not None:
+        return False
+    tr = _Trace(name)
+    _current.set(tr)
+    _path.set(name)
+    if _config["mode"] == "sample":
+        tr.sampler = _Sampler(threading.get_ident())
+        tr.sampler.start()
+    return True
+
+
+def finish_trace() -> Optional[str]:
+    """Close this context's trace; writes and returns a dump path if it was slow."""
+    tr = _current.get()
+    if tr is None:
+        return None
+    _current.set(None)
+    _path.set("")
+    total = time.perf_counter() - tr.t0
+    samples = tr.sampler.stop() if tr.sampler else None
+    if total * 1000 < _config["threshold_ms"]:
+        return None
+    tr.spans.append((tr.name, total))
+    try:
+        return _dump(tr, samples, total)
+    except Exception as e:
+        print(f"[Profiling] Failed to write trace for {tr.name}: {e}")
+        return None
+
+
+@contextmanager
+def trace(name: str):
+    """Trace the enclosed block as one unit of work (no-op when tracing is off)."""
+    opened = start_trace(name)
+    try:
+        yield
+    finally:
+        if opened:
+            finish_trace()
+
+
+@contextmanager
+def span(name: str):
+    """Time the enclosed block as a child of the current span, if a trace is open."""
+    tr = _current.get()
+    if tr is None:
+        yield
+        return
+    path = f"{_path.get()};{name}"
+    token = _path.set(path)
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        tr.spans.append((path, time.perf_counter() - t))
+        _path.reset(token)
+
+
+def timed(name: str):
+    """Decorator form of span()."""
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return fn(*args, **kwargs)
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def _collapse_spans(spans: List[Tuple[str, float]]) -> Dict[str, int]:
+    """Span paths with total durations -> self time in microseconds per path."""
+    totals: Counter = Counter()
+    for path, dur in spans:
+        totals[path] += dur
+    self_time = dict(totals)
+    for path, dur in totals.items():
+        parent = path.rpartition(";")[0]
+        if parent in self_time:
+            self_time[parent] -= dur
+    return {p: max(0, int(t * 1_000_000)) for p, t in self_time.items()}
+
+
+def _dump(tr: _Trace, samples: Optional[Counter], total: float) -> str:
+    os.makedirs(TRACE_DIR, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    safe_name = "".join(c if c.isalnum() or c in "-_" else "_" for c in tr.name)
+    path = os.path.join(TRACE_DIR, f"{stamp}-{safe_name}-{int(total * 1000)}ms.folded")
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, us in sorted(_collapse_spans(tr.spans).items()):
+            if us:
+                f.write(f"{stack} {us}\n")
+    if samples:
+        with open(path[:-len(".folded")] + ".samples.folded", "w", encoding="utf-8") as f:
+            for stack, n in samples.most_common():
+                f.write(f"{stack} {n}\n")
+    print(f"[Profiling] {tr.name} took {total * 1000:.0f}ms, trace written to {path}")
+    return path
@@ -0,0 +1,86 @@
+# bot/rates.py
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from .models import Offer
+
+# each market is fetched once, in its own currency; other currencies are converted locally
+MARKET_CURRENCY = {"uz": "uzs", "ru": "rub", "kz": "kzt", "tr": "try"}
+SUPPORTED_CURRENCIES = ("uzs", "usd", "eur", "rub", "kzt", "try")
+
+RATES_URL = os.getenv("RATES_URL", "https://open.er-api.com/v6/latest/USD")  # empty -> static table only
+RATES_TTL = 55 * 60  # seconds; just under the hourly refresh job, so every run reloads
+
+# stand-in table (units per 1 USD), used until the first successful refresh and
+# whenever the rates service is unreachable or disabled (e.g. in tests)
+STATIC_RATES: Dict[str, float] = {
+    "usd": 1.0,
+    "eur": 0.92,
+    "rub": 92.0,
+    "kzt": 480.0,
+    "try": 34.0,
+    "uzs": 12600.0,
+}
+
+_rates: Dict[str, float] = dict(STATIC_RATES)
+_rates_ts = 0.0
+_lock = threading.Lock()
+
+
+def market_currency(market: str) -> str:
+    return MARKET_CURRENCY.get(market, "uzs")
+
+
+def set_rates(table: Dict[str, float]):
+    """Replace the rate table (units per 1 USD)."""
+    global _rates, _rates_ts
+    with _lock:
+        _rates = {k.lower(): float(v) for k, v in table.items() if v}
+        _rates_ts = time.time()
+
+
+def refresh_rates(force: bool = False) -> bool:
+    """Reload rates from RATES_URL if stale; keeps the current table on failure."""
+    if not RATES_URL or (not force and time.time() - _rates_ts < RATES_TTL):
+        return False
+    import requests
+
+    try:
+        body = requests.get(RATES_URL, timeout=10).json()
+        table = {k.lower(): v for k, v in (body.get("rates") or {}).items() if k.lower() in SUPPORTED_CURRENCIES}
+    except Exception:
+        return False
+    if len(table) < len(SUPPORTED_CURRENCIES):
+        return False
+    set_rates(table)
+    return True
+
+
+def convert(amount: Optional[float], src: str, dst: str) -> Optional[float]:
+    if amount is None or not src or not dst or src.lower() == dst.lower():
+        return amount
+    with _lock:
+        a, b = _rates.get(src.lower()), _rates.get(dst.lower())
+    if not a or not b:
+        return amount
+    return float(amount) * b / a
+
+
+def convert_offer(o: Offer, currency: str) -> Offer:
+    """Offer with value/old_value expressed in `currency`."""
+    if not o.currency or o.currency == currency:
+        return o
+    with _lock:
+        if o.currency.lower() not in _rates or currency.lower() not in _rates:
+            return o
+    return o._replace(
+        value=convert(o.value, o.currency, currency),
+        old_value=convert(o.old_value, o.currency, currency),
+        currency=currency,
+    )
+
+
+def convert_offers(offers: Iterable[Offer], currency: str) -> List[Offer]:
+    return [convert_offer(o, currency) for o in offers]
@@ -0,0 +1,104 @@
+# bot/registry.py
+import threading
+from typing import Callable, Dict, Iterable, List, Optional
+
+from .evaluator import AlertTable
+from .models import Alert
+
+# origin -> destination -> alert_id -> Alert
+AlertIndex = Dict[str, Dict[str, Dict[int, Alert]]]
+
+
+class AlertRegistry:
+    """
+    In-memory view of the active alerts, grouped by origin and destination.
+
+    Loaded once from SQLite at startup; db.py records every alert write here
+    after it commits, so the alerts job never has to read the table.
+    reconcile() re-reads the table periodically to repair any drift.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._by_origin: AlertIndex = {}
+        self._ids: Dict[int, Alert] = {}
+        self._tables: Dict[str, AlertTable] = {}
+        self.loaded = False  # set by the first successful load(); the alerts job retries until then
+
+    # ---------- change log ----------
+    def put(self, alert: Alert):
+        with self._lock:
+            self._drop(alert.id)
+            self._ids[alert.id] = alert
+            self._by_origin.setdefault(alert.origin, {}).setdefault(alert.destination, {})[alert.id] = alert
+            self._tables.pop(alert.origin, None)
+
+    def remove(self, alert_id: int):
+        with self._lock:
+            self._drop(alert_id)
+
+    def set_last_price(self, alert_id: int, price: float):
+        with self._lock:
+            alert = self._ids.get(alert_id)
+            if alert is None:
+                return
+            alert = self._ids[alert_id] = alert._replace(last_price=price)
+            self._by_origin[alert.origin][alert.destination][alert_id] = alert
+            # baseline changes are patched into the array table instead of rebuilding it
+            table = self._tables.get(alert.origin)
+            if table is not None:
+                table.set_baseline(alert_id, price)
+
+    def _drop(self, alert_id: int):
+        alert = self._ids.pop(alert_id, None)
+        if alert is None:
+            return
+        self._tables.pop(alert.origin, None)
+        dests = self._by_origin.get(alert.origin) or {}
+        bucket = dests.get(alert.destination) or {}
+        bucket.pop(alert_id, None)
+        if not bucket:
+            dests.pop(alert.destination, None)
+        if not dests:
+            self._by_origin.pop(alert.origin, None)
+
+    # ---------- loading ----------
+    def load(self, rows: Iterable):
+        with self._lock:
+            self._by_origin, self._ids, self._tables = {}, {}, {}
+            for row in rows:
+                self.put(row if isinstance(row, Alert) else Alert.from_row(row))
+            self.loaded = True
+
+    def reconcile(self, loader: Callable[[], Iterable]) -> int:
+        """Reload from `loader` under the lock; returns how many alerts differed."""
+        with self._lock:
+            before = dict(self._ids)
+            self.load(loader())
+            changed = set(before.items()) ^ set(self._ids.items())
+            return len({a.id for _, a in changed})
+
+    # ---------- reads ----------
+    def origins(self) -> List[str]:
+        with self._lock:
+            return list(self._by_origin)
+
+    def table(self, origin: str) -> Optional[AlertTable]:
+        """Array-backed table of the origin's alerts, built on first use and cached."""
+        with self._lock:
+            table = self._tables.get(origin)
+            if table is None and origin in self._by_origin:
+                alerts = [a for bucket in self._by_origin[origin].values() for a in bucket.values()]
+                table = self._tables[origin] = AlertTable(alerts)
+            return table
+
+    def get(self, alert_id: int) -> Optional[Alert]:
+        with self._lock:
+            return self._ids.get(alert_id)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._ids)
+
+
+alert_registry = AlertRegistry()
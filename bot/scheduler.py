@@ -5,66 +5,134 @@ import time
 import schedule
 import traceback
 from datetime import datetime
+from typing import List, Optional, Tuple
 
-from .db import list_subscriptions
-from .fetcher import try_payloads, build_maps, cheapest_per_destination
+from .db import list_subscriptions, load_alert_registry, get_user_prefs
+from .fetcher import fetch_hot_offers, cheapest_per_destination
 from .formatter import format_card_ru
 from .alerts import check_alerts_once
+from .throttle import upstream_budget, snapshot as throttle_snapshot
+from . import history
+from .profiling import span, trace
+from .rates import convert_offers, market_currency, refresh_rates
 
 PAGE_SIZE = 5
+ALERT_RECONCILE_MINUTES = 30
 
-def send_deals(bot, user_id, origin):
-    """Send first 15 best deals to a user immediately."""
-    data = try_payloads(origin, "uzs", "uz", max_directions=50, locales=["ru"])
+def deal_messages(origin, data, currency) -> Tuple[List[str], Optional[str]]:
+    """Daily-deals messages for a fetch result, plus the parse_mode to send them with."""
     if not data:
-        bot.send_message(user_id, f"Не удалось получить данные от API для {origin}.")
-        return
+        return [f"Не удалось получить данные от API для {origin}."], None
 
-    offers = data.get("one_way_offers") or []
+    offers, cities_map, airlines_map = data
     if not offers:
-        bot.send_message(user_id, f"Нет доступных предложений из {origin}.")
-        return
+        return [f"Нет доступных предложений из {origin}."], None
 
-    cities_map, airlines_map = build_maps(data)
     best = cheapest_per_destination(offers)
-    best.sort(key=lambda o: (o.get("price") or {}).get("value") or float("inf"))
-    cards = [format_card_ru(item, cities_map, airlines_map, origin) for item in best[:PAGE_SIZE*3]]  # first 15 deals
+    best.sort(key=lambda o: o.value)
+    cards = [format_card_ru(item, cities_map, airlines_map, origin) for item in convert_offers(best[:PAGE_SIZE*3], currency)]  # first 15 deals
 
     header = f"🌍 Ежедневные предложения из {cities_map.get(origin, origin)} ({origin})\n\n"
-    for i in range(0, len(cards), PAGE_SIZE):
-        chunk = "\n\n".join(cards[i:i+PAGE_SIZE])
+    return [header + "\n\n".join(cards[i:i+PAGE_SIZE]) for i in range(0, len(cards), PAGE_SIZE)], "Markdown"
+
+def send_deals(bot, user_id, origin):
+    """Send first 15 best deals to a user immediately."""
+    currency, market = get_user_prefs(user_id)
+    upstream_budget.consume()
+    data = fetch_hot_offers(origin, market_currency(market), market, max_directions=50, locales=["ru"])
+    texts, parse_mode = deal_messages(origin, data, currency)
+    for text in texts:
         try:
-            bot.send_message(user_id, header + chunk, parse_mode="Markdown", disable_web_page_preview=True)
+            with span("telegram.send_message"):
+                bot.send_message(user_id, text, parse_mode=parse_mode, disable_web_page_preview=True)
         except Exception:
             print(f"[Scheduler] Failed to send deals to {user_id} for {origin}")
             traceback.print_exc()
 
+def due_subscriptions(now: datetime) -> List[Tuple[int, str]]:
+    """(user_id, origin) for every enabled subscription scheduled at now's HH:MM."""
+    due = []
+    for sub in list_subscriptions():
+        try:
+            # Access sqlite3.Row fields directly
+            if not sub["enabled"]:
+                continue
+            if now.hour == sub["hour"] and now.minute == sub["minute"]:
+                due.append((sub["user_id"], sub["origin"]))
+        except Exception:
+            traceback.print_exc()
+    return due
+
+# ---------- maintenance jobs (shared with the asyncio runtime in aio.py) ----------
+def job_history_flush():
+    try:
+        history.flush()
+    except Exception:
+        print("[Scheduler] Failed to write price history")
+        traceback.print_exc()
+
+def job_history_downsample():
+    try:
+        history.downsample()
+    except Exception:
+        print("[Scheduler] Failed to downsample price history")
+        traceback.print_exc()
+
+def job_refresh_rates():
+    try:
+        refresh_rates()
+    except Exception:
+        print("[Scheduler] Failed to refresh currency rates")
+        traceback.print_exc()
+
+def job_throttle_stats():
+    counts = throttle_snapshot()
+    if counts:
+        print(f"[Scheduler] Throttled requests so far: {counts}")
+
+def job_reconcile_alerts():
+    try:
+        drift = load_alert_registry()
+        if drift:
+            print(f"[Scheduler] Alert registry reconciled, {drift} alerts differed from DB.")
+    except Exception:
+        print("[Scheduler] Error reconciling alert registry")
+        traceback.print_exc()
+
+# (interval in minutes, job)
+MAINTENANCE_JOBS = [
+    (ALERT_RECONCILE_MINUTES, job_reconcile_alerts),
+    (10, job_throttle_stats),
+    (1, job_history_flush),
+    (60, job_history_downsample),
+    (60, job_refresh_rates),
+]
+
 def run_scheduler(bot):
     """Start the scheduler in a background daemon thread."""
     def job_subscriptions():
-        now = datetime.now()
+        with trace("subscriptions_job"):
+            run_subscriptions()
+
+    def run_subscriptions():
         try:
-            subs = list_subscriptions()
+            due = due_subscriptions(datetime.now())
         except Exception:
             print("[Scheduler] Failed to load subscriptions")
             traceback.print_exc()
             return
 
-        for sub in subs:
+        for user_id, origin in due:
             try:
-                # Access sqlite3.Row fields directly
-                if not sub["enabled"]:
-                    continue
-                hour, minute = sub["hour"], sub["minute"]
-                if now.hour == hour and now.minute == minute:
-                    send_deals(bot, sub["user_id"], sub["origin"])
+                send_deals(bot, user_id, origin)
             except Exception:
                 traceback.print_exc()
                 continue
 
     def job_alerts():
         try:
-            sent = check_alerts_once(bot)
+            with trace("alerts_cycle"):
+                sent = check_alerts_once(bot)
             if sent:
                 print(f"[Scheduler] Sent {sent} alert notifications.")
         except Exception:
@@ -75,6 +143,9 @@ def run_scheduler(bot):
         print("[Scheduler] background thread started")
         schedule.every(1).minutes.do(job_subscriptions)
         schedule.every(1).minutes.do(job_alerts)
+        for minutes, job in MAINTENANCE_JOBS:
+            schedule.every(minutes).minutes.do(job)
+        job_refresh_rates()
         while True:
             try:
                 schedule.run_pending()
@@ -0,0 +1,119 @@
+# bot/search.py
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .fetcher import fetch_hot_offers, cheapest_per_destination
+from .models import Offer
+from .state import calendar_cache, calendar_lock, CALENDAR_CACHE_TTL
+from .throttle import upstream_budget, UPSTREAM_RESERVE, stats
+
+MAX_WINDOW_DAYS = 31
+MAX_WORKERS = 4           # upper bound on concurrent upstream requests per search
+DEFAULT_NIGHTS = 7        # stay length for round trips
+
+
+def parse_day(text: str, after: Optional[date] = None) -> Optional[date]:
+    """
+    Parse 'YYYY-MM-DD' or 'DD.MM[.YYYY]' into a date, or None.
+
+    Without a year, the result is the first such day on or after `after`
+    (today by default); pass the start date when parsing the end of a range.
+    """
+    for fmt in ("%Y-%m-%d", "%d.%m.%Y"):
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            pass
+    # parsed together with the year (strptime would otherwise use 1900, so
+    # 29.02 never matched); a leap day is at most four years away
+    after = after or date.today()
+    for year in range(after.year, after.year + 5):
+        try:
+            d = datetime.strptime(f"{text}.{year}", "%d.%m.%Y").date()
+        except ValueError:
+            continue
+        if d >= after:
+            return d
+    return None
+
+
+def _cell_key(origin: str, depart: date, nights: Optional[int], currency: str, market: str) -> tuple:
+    ret = (depart + timedelta(days=nights)).isoformat() if nights is not None else None
+    return (origin, depart.isoformat(), ret, currency, market)
+
+
+def _cached_cell(key: tuple, now: float) -> Optional[Dict[str, Offer]]:
+    with calendar_lock:
+        cell = calendar_cache.get(key)
+    if cell and now - cell["ts"] <= CALENDAR_CACHE_TTL:
+        return cell["prices"]
+    return None
+
+
+def _fetch_cell(key: tuple) -> Optional[Dict[str, Offer]]:
+    """Fetch one origin/date cell upstream; it holds the cheapest offer for every destination."""
+    origin, depart, ret, currency, market = key
+    try:
+        data = fetch_hot_offers(origin, currency, market, max_directions=50, locales=["ru"],
+                                one_way=ret is None, depart_date=depart, return_date=ret)
+    except Exception:
+        traceback.print_exc()
+        return None
+    if data is None:
+        return None
+    # hot offers may still return nearby dates; keep only the requested one
+    same_day = [o for o in data.offers if o.depart_date in (None, depart)]
+    prices = {o.destination: o for o in cheapest_per_destination(same_day)}
+    now = time.time()
+    with calendar_lock:
+        for k in [k for k, v in calendar_cache.items() if now - v["ts"] > CALENDAR_CACHE_TTL]:
+            del calendar_cache[k]
+        calendar_cache[key] = {"ts": now, "prices": prices}
+    return prices
+
+
+def _upstream_token() -> bool:
+    if upstream_budget.try_acquire(reserve=UPSTREAM_RESERVE):
+        return True
+    stats["upstream"] += 1
+    return False
+
+
+def price_calendar(origin: str, destination: str, start: date, end: date, round_trip: bool = False,
+                   nights: int = DEFAULT_NIGHTS, currency: str = "uzs", market: str = "uz",
+                   admit: Callable[[], bool] = _upstream_token) -> Tuple[List[Tuple[date, Optional[Offer]]], List[date]]:
+    """
+    Cheapest offer origin -> destination for every departure day in [start, end].
+
+    Cells are cached per (origin, day, trip) and shared across destinations and
+    users, so only the days missing from the cache are fetched, at most
+    MAX_WORKERS at a time. Every fetch must first pass `admit()` (by default a
+    token from the upstream budget; handlers also charge the user and chat).
+
+    Returns the (day, offer) cells and the days that were skipped, either
+    refused by `admit()` or failed upstream; those are retried on the next search.
+    """
+    if end < start:
+        raise ValueError(f"end {end} is before start {start}")
+    days = [start + timedelta(days=i) for i in range(min((end - start).days + 1, MAX_WINDOW_DAYS))]
+    keys = [_cell_key(origin, d, nights if round_trip else None, currency, market) for d in days]
+
+    now = time.time()
+    cells = {k: _cached_cell(k, now) for k in keys}
+    missing = [k for k, v in cells.items() if v is None]
+    # earliest days first; once admission is refused the remaining days are skipped
+    admitted = []
+    for k in missing:
+        if not admit():
+            break
+        admitted.append(k)
+    if admitted:
+        with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(admitted))) as pool:
+            for k, prices in zip(admitted, pool.map(_fetch_cell, admitted)):
+                cells[k] = prices
+
+    skipped = [d for d, k in zip(days, keys) if cells[k] is None]
+    return [(d, (cells[k] or {}).get(destination)) for d, k in zip(days, keys)], skipped
@@ -1,4 +1,5 @@
 # bot/state.py
+import threading
 import time
 from typing import Dict, Any
 
@@ -7,4 +8,17 @@ sessions: Dict[int, Dict[str, Any]] = {}
 
 # cached cities result with ttl
 cities_cache = {"ts": 0, "data": None}
+
+# guards sessions and cities_cache; handlers run on several worker threads
+state_lock = threading.Lock()
 CITIES_CACHE_TTL = 600  # seconds
+
+# latest hot offers per (origin, currency, market): {"ts", "data": HotOffers}
+offers_cache: Dict[tuple, Dict[str, Any]] = {}
+offers_lock = threading.Lock()
+OFFERS_CACHE_TTL = 300  # seconds
+
+# price calendar cells: (origin, depart_date, return_date, currency, market) -> {"ts", "prices": {dest: Offer}}
+calendar_cache: Dict[tuple, Dict[str, Any]] = {}
+calendar_lock = threading.Lock()
+CALENDAR_CACHE_TTL = 1800  # seconds
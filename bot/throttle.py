@@ -0,0 +1,120 @@
+# bot/throttle.py
+import os
+import threading
+import time
+from collections import Counter
+from typing import Dict, Hashable, Optional
+
+
+class TokenBucket:
+    """Classic token bucket: `capacity` tokens, refilled at `rate` tokens per second."""
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.ts = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.ts) * self.rate)
+        self.ts = now
+
+    def try_acquire(self, n: float = 1, reserve: float = 0) -> bool:
+        """Take `n` tokens if at least `reserve` would remain afterwards."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens - n < reserve:
+                return False
+            self.tokens -= n
+            return True
+
+    def consume(self, n: float = 1):
+        """
+        Take `n` tokens unconditionally (used by the scheduler).
+
+        The balance may go negative, but never below -capacity: a scheduler
+        that spends more than the refill rate keeps handlers out for at most
+        one bucket's worth of refill time, not for ever-growing debt.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = max(-self.capacity, self.tokens - n)
+
+    def refund(self, n: float = 1):
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + n)
+
+    def is_full(self) -> bool:
+        with self._lock:
+            self._refill(time.monotonic())
+            return self.tokens >= self.capacity
+
+
+class KeyedBuckets:
+    """One TokenBucket per key (user id, chat id); idle full buckets are pruned."""
+
+    PRUNE_EVERY = 600  # seconds
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self._buckets: Dict[Hashable, TokenBucket] = {}
+        self._lock = threading.Lock()
+        self._pruned = time.monotonic()
+
+    def get(self, key: Hashable) -> TokenBucket:
+        with self._lock:
+            now = time.monotonic()
+            if now - self._pruned > self.PRUNE_EVERY:
+                self._buckets = {k: b for k, b in self._buckets.items() if not b.is_full()}
+                self._pruned = now
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.capacity, self.rate)
+            return bucket
+
+
+# per user: burst of 5 expensive commands, then one every 10 seconds
+user_buckets = KeyedBuckets(capacity=5, rate=1 / 10)
+# per chat (group chats share one budget): burst of 10, then one every 5 seconds
+chat_buckets = KeyedBuckets(capacity=10, rate=1 / 5)
+# global upstream budget shared with the scheduler (default 30 requests per minute);
+# size it above the number of alert origins polled each minute
+UPSTREAM_PER_MINUTE = int(os.getenv("UPSTREAM_PER_MINUTE", "30"))
+upstream_budget = TokenBucket(capacity=UPSTREAM_PER_MINUTE, rate=UPSTREAM_PER_MINUTE / 60)
+# tokens handlers must leave untouched so the alerts/subscription jobs are never starved
+UPSTREAM_RESERVE = 10
+
+# how many requests were throttled, by reason ("user", "chat", "upstream") plus "served_stale"
+stats: Counter = Counter()
+
+
+def throttled(user_id: int, chat_id: int, upstream: bool = True) -> Optional[str]:
+    """
+    Admission check for an expensive command that needs an upstream fetch.
+
+    Returns the name of the exhausted bucket when the request must be refused,
+    or None when it is admitted (tokens taken from the user, chat and, unless
+    `upstream` is False, the global upstream bucket).
+    """
+    user = user_buckets.get(user_id)
+    if not user.try_acquire():
+        stats["user"] += 1
+        return "user"
+    chat = chat_buckets.get(chat_id)
+    if chat_id != user_id and not chat.try_acquire():
+        user.refund()
+        stats["chat"] += 1
+        return "chat"
+    if upstream and not upstream_budget.try_acquire(reserve=UPSTREAM_RESERVE):
+        user.refund()
+        if chat_id != user_id:
+            chat.refund()
+        stats["upstream"] += 1
+        return "upstream"
+    return None
+
+
+def snapshot() -> Dict[str, int]:
+    return dict(stats)
@@ -0,0 +1,65 @@
+from datetime import date
+
+import pytest
+
+from bot import search
+from bot.search import parse_day, price_calendar
+
+
+def test_parse_day_formats():
+    assert parse_day("2026-11-01") == date(2026, 11, 1)
+    assert parse_day("01.11.2026") == date(2026, 11, 1)
+    assert parse_day("30.02") is None
+    assert parse_day("soon") is None
+
+
+def test_parse_day_without_year_is_next_such_day():
+    today = date(2026, 10, 19)
+    assert parse_day("19.10", after=today) == date(2026, 10, 19)
+    assert parse_day("01.01", after=today) == date(2027, 1, 1)
+    assert parse_day("29.02", after=today) == date(2028, 2, 29)
+
+
+def test_range_end_is_parsed_relative_to_start():
+    start = parse_day("29.02", after=date(2026, 10, 19))
+    assert parse_day("01.03", after=start) == date(2028, 3, 1)
+    start = parse_day("28.02", after=date(2026, 10, 19))
+    assert parse_day("29.02", after=start) == date(2028, 2, 29)
+
+
+@pytest.fixture
+def fake_cells(monkeypatch):
+    fetched = []
+
+    def fetch(key):
+        fetched.append(key)
+        return {}
+
+    monkeypatch.setattr(search, "_fetch_cell", fetch)
+    monkeypatch.setattr(search, "calendar_cache", {})
+    return fetched
+
+
+def test_window_covers_start_to_end(fake_cells):
+    cells, skipped = price_calendar("TAS", "IST", date(2028, 2, 28), date(2028, 3, 1), admit=lambda: True)
+    assert [d for d, _ in cells] == [date(2028, 2, 28), date(2028, 2, 29), date(2028, 3, 1)]
+    assert skipped == []
+
+
+def test_window_is_capped(fake_cells):
+    cells, _ = price_calendar("TAS", "IST", date(2027, 1, 1), date(2027, 12, 31), admit=lambda: True)
+    assert len(cells) == search.MAX_WINDOW_DAYS
+
+
+def test_days_refused_by_admission_are_skipped(fake_cells):
+    tokens = iter([True, True])
+    cells, skipped = price_calendar("TAS", "IST", date(2027, 1, 1), date(2027, 1, 5),
+                                    admit=lambda: next(tokens, False))
+    assert len(fake_cells) == 2
+    assert skipped == [date(2027, 1, 3), date(2027, 1, 4), date(2027, 1, 5)]
+
+
+def test_window_rejects_reversed_dates(fake_cells):
+    with pytest.raises(ValueError):
+        price_calendar("TAS", "IST", date(2027, 3, 1), date(2027, 2, 1))
+    assert not fake_cells